@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+@dataclass
+class Ticket:
+    request_class: str
+    cost: float
+    models: list
+    degraded: bool = False
+
+
+class _Lane:
+    # Concurrency limit with a waiting queue ordered by estimated cost, so cheap requests are not stuck behind
+    # expensive ones of the same class
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiting: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    async def acquire(self, cost: float):
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (cost, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the caller went away, pass it on
+                self.release()
+            else:
+                self._waiting = [item for item in self._waiting if item[2] is not future]
+                heapq.heapify(self._waiting)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                # The slot moves to the waiter directly, `active` stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'limit': self.limit,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+class AdmissionController:
+    """Admits scoring requests into per-class lanes: transformer-only, LLM-backed and OCR.
+
+    When the LLM lane has `degrade_at` or more requests waiting, new LLM-backed requests are degraded to
+    transformer-only scoring instead of queueing. A lane with a full queue rejects with AdmissionRejected.
+    """
+
+    def __init__(self, limits: dict[str, int], max_queue: dict[str, int], degrade_at: Optional[int] = None):
+        self.lanes = {name: _Lane(limit, max_queue[name]) for name, limit in limits.items()}
+        self.degrade_at = degrade_at
+        self.degraded = 0
+
+    @staticmethod
+    def classify(text_length: int, models: list, mime_type: Optional[str] = None) -> tuple[str, float]:
+        # Rough cost in "transformer passes": one per 2000 characters, ~10 per LLM call, ~20 per OCR job
+        llm_calls = sum(1 for model in models if model != 'transformer')
+        cost = 1 + text_length / 2000 + 10 * llm_calls
+        if mime_type is not None and mime_type.startswith('image/'):
+            return 'ocr', cost + 20
+        if llm_calls:
+            return 'llm', cost
+        return 'transformer', cost
+
+    @asynccontextmanager
+    async def admit(self, text_length: int, models: list, mime_type: Optional[str] = None):
+        request_class, cost = self.classify(text_length, models, mime_type)
+        ticket = Ticket(request_class, cost, list(models))
+
+        if request_class == 'llm' and self.degrade_at is not None and self.lanes['llm'].queued >= self.degrade_at:
+            # Keep answering with the transformer alone rather than making everyone wait for the LLMs
+            ticket = Ticket('transformer', 1 + text_length / 2000, ['transformer'], degraded=True)
+            self.degraded += 1
+
+        lane = self.lanes[ticket.request_class]
+        await lane.acquire(ticket.cost)
+        try:
+            yield ticket
+        finally:
+            lane.release()
+
+    def stats(self) -> dict:
+        return {'degraded': self.degraded, **{name: lane.stats() for name, lane in self.lanes.items()}}
@@ -1,7 +1,85 @@
+import os
+
 # Project settings
 PROJECT_NAME = 'AI Text Analyzer'
 
-# Rate limiting
+# Rate limiting: token bucket of MAX_REQUESTS_PER_WINDOW requests per RATE_LIMIT_WINDOW seconds per IP.
+# RATE_LIMIT_BACKEND is 'memory' (single worker), 'sqlite:///path' (workers on one host) or 'redis://...'
 RATE_LIMIT_WINDOW = 60  # seconds
 MAX_REQUESTS_PER_WINDOW = 10
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+# Tokens a request takes from the bucket by path, anything not listed costs 1. Scoring endpoints also take
+# RATE_LIMIT_MODEL_COST per LLM model they ask for once the request is parsed, the batch endpoint takes it per item
+# along with RATE_LIMIT_BATCH_ITEM_COST for the transformer pass of every item. The model cost is 0 by default, which
+# keeps the limit at MAX_REQUESTS_PER_WINDOW requests whatever models they use: at 1, a gpt+claude text costs 3
+# tokens, and the Telegram bot, which sends every user's requests from one IP with both models, gets a third of that
+RATE_LIMIT_COSTS = {
+    '/api/v1/score/text': 1.0,
+    '/api/v1/score/file': 1.0,
+    '/api/v1/score/batch': 1.0,
+    '/api/v1/text/share': 0.2,
+    '/api/v1/text/get': 0.2,
+    '/api/v1/stats': 0.0,
+    '/health/live': 0.0,
+    '/health/ready': 0.0,
+    '/metrics': 0.0,
+}
+RATE_LIMIT_MODEL_COST = float(os.getenv('RATE_LIMIT_MODEL_COST', 0.0))
+RATE_LIMIT_BATCH_ITEM_COST = float(os.getenv('RATE_LIMIT_BATCH_ITEM_COST', 0.005))
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Transformer micro-batching
+TRANSFORMER_MAX_BATCH_SIZE = int(os.getenv('TRANSFORMER_MAX_BATCH_SIZE', 32))
+TRANSFORMER_MAX_WAIT_MS = float(os.getenv('TRANSFORMER_MAX_WAIT_MS', 5))
+# 'background' accepts traffic right away and loads the model in a worker thread (see /health/ready),
+# 'eager' finishes loading during startup
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'background')
+# Worker processes (uvicorn reads WEB_CONCURRENCY as its --workers default). Workers memory-map the same baked
+# safetensors weights, so the weights pages are held once; torch threads are split between the workers
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+# Classifier artifact from `python -m model.export` (e.g. model/transformer.int8.pt), the fp32 weights if unset
+TRANSFORMER_WEIGHTS = os.getenv('TRANSFORMER_WEIGHTS')
+
+# LLM evaluators: per-evaluator timeout and the latency budget for scoring, in seconds
+EVALUATOR_TIMEOUT = float(os.getenv('EVALUATOR_TIMEOUT', 20))
+SCORE_LATENCY_BUDGET = float(os.getenv('SCORE_LATENCY_BUDGET', 25))
+
+# Scoring result cache: in-process LRU size and TTL in seconds, optional SQLite path for a persistent tier
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 10000))
+# Results hold the text, token analysis and windows, so the memory tier is bounded by their JSON size as well
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', 64))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 24 * 3600))
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', '')
+
+# Batch scoring endpoint
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+
+# Document extraction worker pool: processes, jobs allowed to run or wait before answering 503, per-job timeout
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', max((os.cpu_count() or 2) // 2, 1)))
+EXTRACTION_MAX_PENDING = int(os.getenv('EXTRACTION_MAX_PENDING', 4 * EXTRACTION_WORKERS))
+EXTRACTION_TIMEOUT = float(os.getenv('EXTRACTION_TIMEOUT', 30))
+
+# Extracted text budget: 'reject' answers 400 for longer documents, 'truncate' scores the first MAX_TEXT_LENGTH chars
+MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', 10000))
+EXTRACTION_OVERFLOW = os.getenv('EXTRACTION_OVERFLOW', 'reject')
+
+# Storage backend: 'airtable' or e.g. 'sqlite:///data/storage.db'
+STORAGE_URL = os.getenv('STORAGE_URL', 'airtable')
+
+# Write-behind buffering of record and link inserts (Airtable accepts at most 10 records per batch create). Off by
+# default: with several workers, a record shared through one worker is not found by the others until it is flushed
+STORAGE_WRITE_BEHIND = os.getenv('STORAGE_WRITE_BEHIND', '0') == '1'
+STORAGE_BATCH_SIZE = int(os.getenv('STORAGE_BATCH_SIZE', 10))
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', 0.5))
+
+# Admission control: concurrent scoring requests and waiting queue length per class. LLM-backed requests are
+# degraded to transformer-only scoring once ADMISSION_DEGRADE_AT of them are waiting
+ADMISSION_LIMITS = {
+    'transformer': int(os.getenv('ADMISSION_TRANSFORMER_LIMIT', 32)),
+    'llm': int(os.getenv('ADMISSION_LLM_LIMIT', 16)),
+    'ocr': int(os.getenv('ADMISSION_OCR_LIMIT', 4)),
+}
+ADMISSION_MAX_QUEUE = {'transformer': 512, 'llm': 128, 'ocr': 16}
+ADMISSION_DEGRADE_AT = int(os.getenv('ADMISSION_DEGRADE_AT', 32))
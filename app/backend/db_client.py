@@ -1,21 +1,43 @@
 import json
 import os
+import sys
 import uuid
 from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
-from pyairtable import Table
+from pyairtable import Api
+from pyairtable.formulas import match
+
+from model.cache import LRUCache
 
 load_dotenv()
 
+# Memory the cached records may take, texts and token lists included
+RECORD_CACHE_BYTES = int(os.getenv('AIRTABLE_RECORD_CACHE_MB', 64)) * 1024 * 1024
+
+
+def _record_size(record: Dict) -> int:
+    # Approximate size of a normalized record: its strings plus about 300 bytes per token dict
+    strings = (record['text'], record['explanation'], record['examples'])
+    return sum(sys.getsizeof(value) for value in strings if value) + 300 * len(record['tokens'])
+
 
 class AirtableClient:
-    def __init__(self):
+    def __init__(self, api: Optional[Api] = None):
         self.token = os.getenv('AIRTABLE_TOKEN')
-        self.base_id = 'appBdrOMH7UmeXVyA'
-        self.records_table = Table(self.token, self.base_id, 'Records')
-        self.users_table = Table(self.token, self.base_id, 'Users')
-        self.links_table = Table(self.token, self.base_id, 'Links')
+        self.base_id = os.getenv('AIRTABLE_BASE_ID', 'appBdrOMH7UmeXVyA')
+        # AIRTABLE_ENDPOINT_URL points the client at a local fake Airtable in tests
+        api = api or Api(self.token, endpoint_url=os.getenv('AIRTABLE_ENDPOINT_URL', 'https://api.airtable.com'))
+        self.records_table = api.table(self.base_id, 'Records')
+        self.users_table = api.table(self.base_id, 'Users')
+        self.links_table = api.table(self.base_id, 'Links')
+
+        # Write-through indexes in front of the server-side filtered queries. User ids and records never change,
+        # the latest record of a user does, so it expires quickly in case another process added one. Records hold
+        # whole texts, so they are bounded by memory as well as by count
+        self._user_ids: LRUCache = LRUCache(max_size=10000, ttl=None)
+        self._records: LRUCache = LRUCache(max_size=10000, ttl=None, max_bytes=RECORD_CACHE_BYTES, sizeof=_record_size)
+        self._last_record_ids: LRUCache = LRUCache(max_size=10000, ttl=60)
 
     def create_user(self, tg_id: Optional[str], login: Optional[str], password: Optional[str]) -> Dict:
         data = {}
@@ -26,42 +48,95 @@ class AirtableClient:
         if password:
             data['password'] = password
         data['user_id'] = uuid.uuid4().hex
-        return self.users_table.create(data)
+        user = self.users_table.create(data)
+        if tg_id:
+            self._user_ids.set(str(tg_id), data['user_id'])
+        return user
 
     def get_user_id_by_tg_id(self, tg_id: str) -> Optional[str]:
-        users = self.users_table.all()
-        for user in users:
-            fields = user.get('fields', {})
-            if fields.get('tg_id') == tg_id:
-                return fields.get('user_id')
-        return None
+        tg_id = str(tg_id)
+        user_id = self._user_ids.get(tg_id)
+        if user_id is not None:
+            return user_id
+
+        user = self.users_table.first(formula=match({'tg_id': tg_id}))
+        if not user:
+            return None
+        user_id = user.get('fields', {}).get('user_id')
+        if user_id:
+            self._user_ids.set(tg_id, user_id)
+        return user_id
 
     def create_record(
-        self, text: str, tokens: List[Dict[str, float]], explanation: str, score: float, examples: str
+        self,
+        text: str,
+        tokens: List[Dict[str, float]],
+        explanation: str,
+        score: float,
+        examples: str,
+        record_id: Optional[str] = None,
     ) -> Dict:
-        data = {
-            'record_id': uuid.uuid4().hex,
+        data = self._record_fields(record_id or uuid.uuid4().hex, text, tokens, explanation, score, examples)
+        record = self.records_table.create(data)
+        self._records.set(data['record_id'], self._normalize_record(record))
+        return record
+
+    def create_records(self, records: List[Dict]) -> List[Dict]:
+        # Takes normalized records; pyairtable sends them in chunks of 10, the Airtable maximum per request. Upserting
+        # on record_id makes a retried write idempotent, a record that already made it is updated, not duplicated
+        created = self.records_table.batch_upsert(
+            [{'fields': self._record_fields(**record)} for record in records], key_fields=['record_id']
+        )['records']
+        for record in created:
+            self._records.set(record['fields']['record_id'], self._normalize_record(record))
+        return created
+
+    def _record_fields(
+        self, record_id: str, text: str, tokens: List[Dict[str, float]], explanation: str, score: float, examples: str
+    ) -> Dict:
+        return {
+            'record_id': record_id,
             'text': text,
             'tokens': json.dumps(tokens),
             'explanation': explanation,
             'score': str(score),
             'examples': examples,
         }
-        return self.records_table.create(data)
 
     def link_user_to_record(self, user_id: str, record_id: str) -> Dict:
         data = {
             'user_id': user_id,
             'record_id': record_id,
         }
-        return self.links_table.create(data)
+        link = self.links_table.create(data)
+        self._update_last_record_id(user_id, record_id)
+        return link
+
+    def link_users_to_records(self, links: List[tuple[str, str]]) -> List[Dict]:
+        created = self.links_table.batch_upsert(
+            [{'fields': {'user_id': user_id, 'record_id': record_id}} for user_id, record_id in links],
+            key_fields=['user_id', 'record_id'],
+        )['records']
+        for user_id, record_id in links:
+            self._update_last_record_id(user_id, record_id)
+        return created
+
+    def _update_last_record_id(self, user_id: str, record_id: str):
+        last_record_id = self._last_record_ids.get(user_id)
+        if last_record_id is not None and record_id > last_record_id:
+            self._last_record_ids.set(user_id, record_id)
 
     def get_record_by_id(self, record_id: str) -> Optional[Dict]:
-        records = self.records_table.all()
-        for record in records:
-            if record['fields'].get('record_id') == record_id:
-                return self._normalize_record(record)
-        return None
+        record = self._records.get(record_id)
+        if record is not None:
+            return record
+
+        record = self.records_table.first(formula=match({'record_id': record_id}))
+        if not record:
+            return None
+        record = self._normalize_record(record)
+        self._records.set(record_id, record)
+        return record
 
     def get_last_record(self) -> Optional[Dict]:
         records = self.records_table.all(sort=['-record_id'])
@@ -73,15 +148,21 @@ class AirtableClient:
         user_id = self.get_user_id_by_tg_id(tg_id)
         if not user_id:
             return None
-        links = self.links_table.all()
-        record_ids = [link['fields']['record_id'] for link in links if link['fields'].get('user_id') == user_id]
-        if not record_ids:
-            return None
-        records = self.records_table.all()
-        user_records = [r for r in records if r['fields'].get('record_id') in record_ids]
-        user_records.sort(key=lambda r: r['fields'].get('record_id', ''), reverse=True)
-        if user_records:
-            return self._normalize_record(user_records[0])
+
+        last_record_id = self._last_record_ids.get(user_id)
+        if last_record_id is not None:
+            record = self.get_record_by_id(last_record_id)
+            if record is not None:
+                return record
+
+        links = self.links_table.all(formula=match({'user_id': user_id}), fields=['record_id'])
+        record_ids = sorted({link['fields']['record_id'] for link in links if 'record_id' in link['fields']})
+        # The record with the greatest record_id wins; skip links whose record no longer exists
+        for record_id in reversed(record_ids):
+            record = self.get_record_by_id(record_id)
+            if record is not None:
+                self._last_record_ids.set(user_id, record_id)
+                return record
         return None
 
     def _normalize_record(self, record: Dict) -> Dict:
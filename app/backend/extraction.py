@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing as mp
+import os
+import signal
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from app.backend.utils import extract_text
+
+
+class ExtractionQueueFull(Exception):
+    pass
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class ExtractionFailed(Exception):
+    pass
+
+
+def _register_worker(pids):
+    pids.put(os.getpid())
+
+
+class ExtractionPool:
+    """Runs CPU-heavy text extraction (PDF, Office, OCR) in worker processes, off the event loop.
+
+    At most `max_pending` jobs may be running or waiting at once, further submissions fail fast with
+    ExtractionQueueFull. A job exceeding `timeout` seconds is abandoned and the pool is restarted, since a worker
+    stuck in Tesseract cannot be interrupted otherwise. Jobs that were running on a pool restarted because of another
+    job are retried once on the new pool.
+
+    Workers are started from a forkserver: forking the server process itself, with torch and the event loop's
+    threads running, could leave a child holding locks that no thread will ever release.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8, timeout: float = 30.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._worker_pids = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = mp.get_context('forkserver')
+            context.set_forkserver_preload(['app.backend.utils'])
+            # Every worker reports its PID here on start, so a restart can kill workers stuck in a job
+            self._worker_pids = context.SimpleQueue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_register_worker,
+                initargs=(self._worker_pids,),
+            )
+        return self._executor
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        # Only the pool the failing job ran on is replaced. Jobs from a pool that was already replaced must not
+        # take down the new one and the requests running on it
+        if executor is not self._executor:
+            return
+        pids, self._executor, self._worker_pids = self._worker_pids, None, None
+        executor.shutdown(wait=False, cancel_futures=True)
+        while not pids.empty():
+            try:
+                os.kill(pids.get(), signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    async def _run(self, job) -> str:
+        executor = self._get_executor()
+        future = asyncio.get_running_loop().run_in_executor(executor, job)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._restart(executor)
+            raise ExtractionTimeout()
+        except asyncio.CancelledError:
+            # The client went away, but the job keeps its worker busy until it finishes on its own
+            future.cancel()
+            raise
+        except BrokenProcessPool:
+            if executor is not self._executor:
+                # Another job's timeout restarted the pool under this one, the job itself did nothing wrong
+                raise
+            # A worker died, possibly on this very document
+            self._restart(executor)
+            raise ExtractionFailed()
+
+    async def extract(self, mime_type: str, content: bytes, max_chars: Optional[int] = None, truncate=True) -> str:
+        if self.pending >= self.max_pending:
+            raise ExtractionQueueFull()
+
+        self.pending += 1
+        try:
+            job = partial(extract_text, mime_type, content, max_chars, truncate)
+            try:
+                return await self._run(job)
+            except BrokenProcessPool:
+                try:
+                    return await self._run(job)
+                except BrokenProcessPool:
+                    raise ExtractionFailed()
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {'pending': self.pending, 'max_pending': self.max_pending, 'max_workers': self.max_workers}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._restart(self._executor)
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class ComponentNotReady(Exception):
+    pass
+
+
+class BackgroundLoader:
+    """Builds a heavy component with `factory` in a worker thread, so the server can answer while it loads.
+
+    `get()` returns the component once loaded and raises ComponentNotReady before that (or if loading failed). A
+    failed load is logged with its traceback and leaves `failed` set, it is not retried.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._task: Optional[asyncio.Task] = None
+        self.error: Optional[BaseException] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.create_task(self._load())
+            self._task.add_done_callback(self._on_done)
+        return self._task
+
+    def _on_done(self, task: asyncio.Task):
+        # Retrieves the exception of the task, nothing else awaits it when loading in the background
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.error = error
+            logger.error('component_load_failed', component=self.name, error=str(error), exc_info=error)
+
+    async def _load(self):
+        self.started_at = time.monotonic()
+        logger.info('component_loading', component=self.name)
+        self._value = await asyncio.to_thread(self.factory)
+        self.load_seconds = time.monotonic() - self.started_at
+        logger.info('component_loaded', component=self.name, seconds=round(self.load_seconds, 2))
+
+    def get(self):
+        if self._value is None:
+            raise ComponentNotReady(self.name)
+        return self._value
+
+    def status(self) -> dict:
+        if self.ready:
+            state = 'ready'
+        elif self.failed:
+            state = 'failed'
+        elif self._task is not None:
+            state = 'loading'
+        else:
+            state = 'not_started'
+        return {'state': state, 'load_seconds': self.load_seconds, 'error': str(self.error) if self.error else None}
@@ -1,34 +1,69 @@
+import asyncio
+import importlib.util
+import json
 import sys
 from pathlib import Path
-from datetime import datetime, timedelta
-from collections import defaultdict
 import logging
 import uuid
 import os
-from typing import Optional
+import time
+from typing import Literal, Optional
 
 project_root = str(Path(__file__).parent.parent.parent)
 sys.path.append(project_root)
 
 import magic
-import torch
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, HTTPException, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, validator
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+from pydantic import BaseModel, Field, ValidationError, validator
 import structlog
 
-from app.backend.config import PROJECT_NAME
-from app.backend.db_client import AirtableClient
-from app.backend.utils import (
-    extract_text_from_docx,
-    extract_text_from_image,
-    extract_text_from_pdf,
-    extract_text_from_pptx,
-    extract_text_from_txt,
+from app.backend.config import (
+    ADMISSION_DEGRADE_AT,
+    ADMISSION_LIMITS,
+    ADMISSION_MAX_QUEUE,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_ITEMS,
+    EVALUATOR_TIMEOUT,
+    EXTRACTION_MAX_PENDING,
+    EXTRACTION_OVERFLOW,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_WORKERS,
+    MAX_REQUESTS_PER_WINDOW,
+    MAX_TEXT_LENGTH,
+    MODEL_LOADING,
+    PROJECT_NAME,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_BATCH_ITEM_COST,
+    RATE_LIMIT_COSTS,
+    RATE_LIMIT_MODEL_COST,
+    RATE_LIMIT_WINDOW,
+    RESULT_CACHE_MB,
+    RESULT_CACHE_PATH,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    SCORE_LATENCY_BUDGET,
+    STORAGE_BATCH_SIZE,
+    STORAGE_FLUSH_INTERVAL,
+    STORAGE_URL,
+    STORAGE_WRITE_BEHIND,
+    TRANSFORMER_MAX_BATCH_SIZE,
+    TRANSFORMER_MAX_WAIT_MS,
+    TORCH_THREADS,
+    TRANSFORMER_WEIGHTS,
+    WEB_CONCURRENCY,
 )
-from model.model import Model
+from app.backend.admission import AdmissionController, AdmissionRejected
+from app.backend.extraction import ExtractionFailed, ExtractionPool, ExtractionQueueFull, ExtractionTimeout
+from app.backend.loader import BackgroundLoader, ComponentNotReady
+from app.backend.rate_limiter import RateLimiter, create_backend
+from app.backend.storage import create_storage
+from app.backend.utils import DOCUMENT_EXTRACTORS, TextTooLong, extract_text_from_txt, take_text
+from model.cache import LRUCache, ResultCache, SQLiteCache, json_size
+from model.metrics import LATENCY_BUCKETS
 
 load_dotenv()
 
@@ -53,12 +88,27 @@ app.add_middleware(
 )
 
 
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds',
+    'Time to produce the response headers per route',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS,
+)
+
+
 # Request tracking middleware
 @app.middleware('http')
 async def add_request_id(request: Request, call_next):
     request_id = str(uuid.uuid4())
     request.state.request_id = request_id
-    response = await call_next(request)
+    # Everything logged while handling the request, model stages included, carries its request_id
+    start = time.perf_counter()
+    with structlog.contextvars.bound_contextvars(request_id=request_id):
+        response = await call_next(request)
+    route = request.scope.get('route')
+    HTTP_REQUEST_SECONDS.labels(
+        method=request.method, route=route.path if route else 'unmatched', status=response.status_code
+    ).observe(time.perf_counter() - start)
     response.headers['X-Request-ID'] = request_id
     return response
 
@@ -75,15 +125,120 @@ async def add_security_headers(request: Request, call_next):
     return response
 
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-model = Model(device=device)
-db = AirtableClient()
+result_cache = ResultCache(
+    memory=LRUCache(
+        max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MB * 1024 * 1024, sizeof=json_size
+    ),
+    disk=SQLiteCache(RESULT_CACHE_PATH) if RESULT_CACHE_PATH else None,
+)
+
+
+def load_model():
+    # torch, transformers and langchain are imported here rather than at module level, so the server starts
+    # answering health checks before they are loaded
+    import torch
+
+    from model.model import Model
+
+    # Without this every worker would start one thread per core and they would fight over the CPUs
+    torch.set_num_threads(TORCH_THREADS)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = Model(
+        device=device,
+        max_batch_size=TRANSFORMER_MAX_BATCH_SIZE,
+        max_wait_ms=TRANSFORMER_MAX_WAIT_MS,
+        evaluator_timeout=EVALUATOR_TIMEOUT,
+        latency_budget=SCORE_LATENCY_BUDGET,
+        cache=result_cache,
+        weights=TRANSFORMER_WEIGHTS,
+    )
+    if WEB_CONCURRENCY > 1 and model.weights_path.suffix != '.safetensors':
+        logger.warning('weights_not_shared', workers=WEB_CONCURRENCY, weights=str(model.weights_path))
+    return model
+
+
+# The model is loaded in the background, where a missing optional package would only show up after startup
+if TRANSFORMER_WEIGHTS and Path(TRANSFORMER_WEIGHTS).suffix == '.onnx' and not importlib.util.find_spec('onnxruntime'):
+    raise RuntimeError(f'TRANSFORMER_WEIGHTS={TRANSFORMER_WEIGHTS} needs onnxruntime: pip install onnxruntime')
+
+model_loader = BackgroundLoader('model', load_model)
+
+
+def get_model():
+    try:
+        return model_loader.get()
+    except ComponentNotReady:
+        raise HTTPException(
+            status_code=503, detail='Модель загружается. Пожалуйста, попробуйте позже.', headers={'Retry-After': '5'}
+        )
+
+
+db = create_storage(
+    STORAGE_URL,
+    write_behind=STORAGE_WRITE_BEHIND,
+    batch_size=STORAGE_BATCH_SIZE,
+    flush_interval=STORAGE_FLUSH_INTERVAL,
+)
+extraction_pool = ExtractionPool(
+    max_workers=EXTRACTION_WORKERS, max_pending=EXTRACTION_MAX_PENDING, timeout=EXTRACTION_TIMEOUT
+)
+
+admission = AdmissionController(ADMISSION_LIMITS, ADMISSION_MAX_QUEUE, degrade_at=ADMISSION_DEGRADE_AT)
+
+
+@app.on_event('startup')
+async def startup():
+    task = model_loader.start()
+    if MODEL_LOADING == 'eager':
+        # Do not accept traffic until the model is loaded
+        await task
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    extraction_pool.shutdown()
+    await db.close()
+    await rate_limiter.backend.close()
+
 
-# Rate limiting configuration
-RATE_LIMIT_WINDOW = 60  # Time window in seconds
-MAX_REQUESTS_PER_WINDOW = 10  # Maximum requests allowed per window
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
-IP_REQUEST_COUNTS: dict[str, tuple[int, datetime]] = defaultdict(lambda: (0, datetime.now()))
+
+# Rate limiting, shared across workers when RATE_LIMIT_BACKEND points at SQLite or Redis
+rate_limiter = RateLimiter(
+    create_backend(RATE_LIMIT_BACKEND),
+    capacity=MAX_REQUESTS_PER_WINDOW,
+    window=RATE_LIMIT_WINDOW,
+    costs=RATE_LIMIT_COSTS,
+)
+
+
+def rate_limit_detail(retry_after: int) -> str:
+    return f'Слишком много запросов. Пожалуйста, попробуйте снова через {retry_after} секунд.'
+
+
+async def charge_models(request: Request, models: list, items: int = 1, item_cost: float = 0.0) -> None:
+    # The middleware took the cost of the path, each item takes `item_cost` and RATE_LIMIT_MODEL_COST per LLM model
+    llm_models = {m for m in models if m != 'transformer'}
+    per_item = item_cost + RATE_LIMIT_MODEL_COST * len(llm_models)
+    cost = items * per_item
+    if cost > rate_limiter.capacity:
+        # More than a full bucket would never be admitted, however long the client waits
+        raise HTTPException(
+            status_code=413,
+            detail=f'Слишком много текстов для выбранных моделей. Максимум: {int(rate_limiter.capacity // per_item)}',
+        )
+    retry_after = await rate_limiter.charge(request.client.host, cost)
+    if retry_after:
+        logger.warning(
+            'rate_limit_exceeded',
+            ip=request.client.host,
+            request_id=request.state.request_id,
+            path=request.url.path,
+            models=sorted(llm_models),
+        )
+        raise HTTPException(
+            status_code=429, detail=rate_limit_detail(retry_after), headers={'Retry-After': str(retry_after)}
+        )
 
 
 @app.middleware('http')
@@ -91,35 +246,15 @@ async def rate_limit_middleware(request: Request, call_next):
     client_ip = request.client.host
     request_id = getattr(request.state, 'request_id', 'unknown')
 
-    # Get current count and timestamp for this IP
-    count, timestamp = IP_REQUEST_COUNTS[client_ip]
-    current_time = datetime.now()
-
-    # Reset counter if window has passed
-    if current_time - timestamp > timedelta(seconds=RATE_LIMIT_WINDOW):
-        count = 0
-        timestamp = current_time
-
-    # Increment counter
-    count += 1
-    IP_REQUEST_COUNTS[client_ip] = (count, timestamp)
-
-    # Check if rate limit exceeded
-    if count > MAX_REQUESTS_PER_WINDOW:
-        logger.warning('rate_limit_exceeded', ip=client_ip, request_id=request_id, count=count)
+    retry_after = await rate_limiter.acquire(client_ip, request.url.path)
+    if retry_after:
+        logger.warning('rate_limit_exceeded', ip=client_ip, request_id=request_id, path=request.url.path)
         return JSONResponse(
             status_code=429,
-            content={
-                'detail': f'Слишком много запросов. Пожалуйста, попробуйте снова через {RATE_LIMIT_WINDOW} секунд.'
-            },
+            content={'detail': rate_limit_detail(retry_after)},
+            headers={'Retry-After': str(retry_after)},
         )
 
-    # Clean up old entries
-    if len(IP_REQUEST_COUNTS) > 10000:
-        current_time = datetime.now()
-        IP_REQUEST_COUNTS.clear()
-        logger.info('rate_limit_cache_cleared')
-
     try:
         response = await call_next(request)
         return response
@@ -130,9 +265,10 @@ async def rate_limit_middleware(request: Request, call_next):
 
 class TextRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=10000)
-    models: list = Field(
+    models: list[str] = Field(
         ...,
     )
+    window_aggregation: Literal['mean', 'weighted', 'max_ai'] = 'weighted'
 
     @validator('text')
     def validate_text_length(cls, v):
@@ -149,20 +285,32 @@ class TokenAnalysis(BaseModel):
     is_special_token: bool
 
 
+class WindowScore(BaseModel):
+    start: int  # Character offsets of the window in the text
+    end: int
+    tokens: int
+    score: float
+
+
 class ScoreTextResponse(BaseModel):
     score: float
     tokens: list[TokenAnalysis]
     explanation: str
     examples: str
+    windows: list[WindowScore] = []
+    degraded: bool = False  # LLM evaluators were skipped because the server is overloaded
 
 
 @app.post('/api/v1/score/text', response_model=ScoreTextResponse)
 async def root(request: Request, text_request: TextRequest):
+    model = get_model()
+    await charge_models(request, text_request.models)
     try:
         logger.info('text_score_request', request_id=request.state.request_id, text_length=len(text_request.text))
         models_list = text_request.models
         models_list += ['transformer']
-        result = await model.ainvoke(text_request.text, models_list)
+        async with admission.admit(len(text_request.text), models_list) as ticket:
+            result = await model.ainvoke(text_request.text, ticket.models, text_request.window_aggregation)
 
         return {
             'score': result['score'],
@@ -170,7 +318,12 @@ async def root(request: Request, text_request: TextRequest):
             'text': text_request.text,
             'tokens': result['tokens'],
             'examples': result['examples'],
+            'windows': result['windows'],
+            'degraded': ticket.degraded,
         }
+    except AdmissionRejected:
+        logger.warning('admission_rejected', request_id=request.state.request_id)
+        raise HTTPException(status_code=503, detail='Сервер перегружен. Пожалуйста, попробуйте позже.')
     except ValueError as e:
         logger.error('text_score_error', request_id=request.state.request_id, error=str(e))
         raise HTTPException(status_code=400, detail=str(e))
@@ -179,6 +332,18 @@ async def root(request: Request, text_request: TextRequest):
         raise HTTPException(status_code=500, detail='Ошибка обработки текста')
 
 
+def parse_models(models: Optional[str]) -> list:
+    if models is not None and models.strip():
+        models_list = [m.strip() for m in models.split(',') if m.strip()]
+        if not models_list:
+            models_list = ['gpt', 'claude']
+        elif not all(m in ['gpt', 'claude'] for m in models_list):
+            raise HTTPException(status_code=400, detail='Недопустимые модели. Поддерживаемые модели: gpt, claude')
+    else:
+        models_list = []
+    return models_list + ['transformer']
+
+
 class ScoreFileResponse(BaseModel):
     score: float
     text: str
@@ -186,12 +351,20 @@ class ScoreFileResponse(BaseModel):
     tokens: list[TokenAnalysis]
     explanation: str
     examples: str
+    windows: list[WindowScore] = []
+    degraded: bool = False
 
 
 @app.post('/api/v1/score/file', response_model=ScoreFileResponse)
-async def analyze_file(request: Request, file: UploadFile = File(...), models: Optional[str] = None):
+async def analyze_file(
+    request: Request,
+    file: UploadFile = File(...),
+    models: Optional[str] = None,
+    window_aggregation: Literal['mean', 'weighted', 'max_ai'] = 'weighted',
+):
     request_id = request.state.request_id
     logger.info('file_score_request', request_id=request_id, filename=file.filename)
+    model = get_model()
 
     content = await file.read()
 
@@ -203,61 +376,69 @@ async def analyze_file(request: Request, file: UploadFile = File(...), models: O
             detail=f'Файл слишком большой. Максимальный размер файла: {MAX_FILE_SIZE // (1024 * 1024)}MB',
         )
 
-    if models is not None and models.strip():
-        models_list = [m.strip() for m in models.split(',') if m.strip()]
-        if not models_list:
-            models_list = ['gpt', 'claude']
-        elif not all(m in ['gpt', 'claude'] for m in models_list):
-            raise HTTPException(status_code=400, detail='Недопустимые модели. Поддерживаемые модели: gpt, claude')
-    else:
-        models_list = []
-    models_list += ['transformer']
+    models_list = parse_models(models)
+    await charge_models(request, models_list)
 
     # Detect MIME type
     mime = magic.Magic(mime=True)
     mime_type = mime.from_buffer(content)
 
-    # Extract text based on file type
+    # Extract text based on file type, parsing and OCR run in the extraction worker pool.
+    # Extraction stops once MAX_TEXT_LENGTH characters are read, so large documents are never parsed in full
+    truncate = EXTRACTION_OVERFLOW == 'truncate'
     try:
-        if mime_type.startswith('image/'):
-            text = extract_text_from_image(content)
-        elif mime_type == 'text/plain':
-            text = extract_text_from_txt(content)
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            text = extract_text_from_docx(content)
-        elif mime_type == 'application/pdf':
-            text = extract_text_from_pdf(content)
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.presentationml.presentation':
-            text = extract_text_from_pptx(content)
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f'Неподдерживаемый тип файла: {mime_type}. Поддерживаемые типы: изображения (PNG, JPEG и т.д.), text/plain, application/pdf, application/vnd.openxmlformats-officedocument.wordprocessingml.document, application/vnd.openxmlformats-officedocument.presentationml.presentation',
-            )
-
-        if not text.strip():
-            raise HTTPException(status_code=400, detail='В файле не найден текстовый контент')
-
-        if len(text) > 10000:
-            raise HTTPException(status_code=400, detail='Длина извлеченного текста не может превышать 10000 символов')
-
-        result = await model.ainvoke(text, models_list)
-
-        db.create_record(text, result['tokens'], result['explanation'], result['score'], result['examples'])
-
-        return {
-            'score': result['score'],
-            'text': text,
-            'explanation': result['explanation'],
-            'mime_type': mime_type,
-            'tokens': result['tokens'],
-            'examples': result['examples'],
-        }
+        # The file size stands in for the text length, which is unknown until extraction
+        text_length = min(len(content), MAX_TEXT_LENGTH)
+        async with admission.admit(text_length, models_list, mime_type) as ticket:
+            if mime_type == 'text/plain':
+                text = take_text([extract_text_from_txt(content)], MAX_TEXT_LENGTH, truncate)
+            elif mime_type.startswith('image/') or mime_type in DOCUMENT_EXTRACTORS:
+                try:
+                    text = await extraction_pool.extract(mime_type, content, MAX_TEXT_LENGTH, truncate)
+                except ExtractionQueueFull:
+                    logger.warning('extraction_queue_full', request_id=request_id, pending=extraction_pool.pending)
+                    raise HTTPException(status_code=503, detail='Сервер перегружен. Пожалуйста, попробуйте позже.')
+                except ExtractionTimeout:
+                    logger.warning('extraction_timeout', request_id=request_id, mime_type=mime_type)
+                    raise HTTPException(status_code=504, detail='Не удалось извлечь текст из файла за отведенное время')
+                except ExtractionFailed:
+                    logger.warning('extraction_failed', request_id=request_id, mime_type=mime_type)
+                    raise HTTPException(status_code=422, detail='Не удалось извлечь текст из файла')
+            else:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f'Неподдерживаемый тип файла: {mime_type}. Поддерживаемые типы: изображения (PNG, JPEG и т.д.), text/plain, application/pdf, application/vnd.openxmlformats-officedocument.wordprocessingml.document, application/vnd.openxmlformats-officedocument.presentationml.presentation',
+                )
+
+            if not text.strip():
+                raise HTTPException(status_code=400, detail='В файле не найден текстовый контент')
+
+            result = await model.ainvoke(text, ticket.models, window_aggregation)
+
+            await db.create_record(text, result['tokens'], result['explanation'], result['score'], result['examples'])
+
+            return {
+                'score': result['score'],
+                'text': text,
+                'explanation': result['explanation'],
+                'mime_type': mime_type,
+                'tokens': result['tokens'],
+                'examples': result['examples'],
+                'windows': result['windows'],
+                'degraded': ticket.degraded,
+            }
     except UnicodeDecodeError:
         raise HTTPException(
             status_code=400,
             detail='Некорректная кодировка текста. Пожалуйста, убедитесь, что файл закодирован в UTF-8.',
         )
+    except TextTooLong:
+        raise HTTPException(
+            status_code=400, detail=f'Длина извлеченного текста не может превышать {MAX_TEXT_LENGTH} символов'
+        )
+    except AdmissionRejected:
+        logger.warning('admission_rejected', request_id=request_id, mime_type=mime_type)
+        raise HTTPException(status_code=503, detail='Сервер перегружен. Пожалуйста, попробуйте позже.')
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except HTTPException as e:
@@ -266,6 +447,94 @@ async def analyze_file(request: Request, file: UploadFile = File(...), models: O
         raise HTTPException(status_code=500, detail=f'Ошибка обработки файла: {str(e)}')
 
 
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    text: str = Field(..., min_length=1, max_length=10000)
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    models: list[str] = Field(default_factory=list)
+    window_aggregation: Literal['mean', 'weighted', 'max_ai'] = 'weighted'
+
+
+def parse_ndjson_items(body: bytes) -> list[BatchItem]:
+    items = []
+    for number, line in enumerate(body.decode('utf-8').splitlines(), 1):
+        if not line.strip():
+            continue
+        value = json.loads(line)
+        # Each line is either a bare JSON string or an object with `text` and an optional `id`
+        if isinstance(value, str):
+            items.append(BatchItem(text=value))
+        elif isinstance(value, dict):
+            items.append(BatchItem.model_validate(value))
+        else:
+            raise ValueError(f'строка {number}: ожидается строка или объект, получено {type(value).__name__}')
+    return items
+
+
+@app.post('/api/v1/score/batch')
+async def score_batch(
+    request: Request,
+    models: Optional[str] = None,
+    window_aggregation: Literal['mean', 'weighted', 'max_ai'] = 'weighted',
+):
+    # Accepts a JSON BatchRequest or an NDJSON body with one text per line (models then come from the query string).
+    # Results are streamed back as NDJSON in completion order, `index` points at the item in the request
+    request_id = request.state.request_id
+    model = get_model()
+    body = await request.body()
+
+    try:
+        if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+            batch = BatchRequest(
+                items=parse_ndjson_items(body), models=parse_models(models), window_aggregation=window_aggregation
+            )
+        else:
+            batch = BatchRequest.model_validate_json(body)
+            batch.models = parse_models(','.join(m for m in batch.models if m != 'transformer'))
+    except (ValidationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f'Некорректный запрос: {str(e)}')
+
+    logger.info('batch_score_request', request_id=request_id, items=len(batch.items))
+    await charge_models(request, batch.models, len(batch.items), RATE_LIMIT_BATCH_ITEM_COST)
+
+    # Transformer passes are batched by the model, this only bounds how many LLM calls are in flight
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def score_item(index: int, item: BatchItem) -> dict:
+        async with semaphore:
+            try:
+                async with admission.admit(len(item.text), batch.models) as ticket:
+                    result = await model.ainvoke(item.text, ticket.models, batch.window_aggregation)
+            except AdmissionRejected:
+                return {'index': index, 'id': item.id, 'error': 'Сервер перегружен. Пожалуйста, попробуйте позже.'}
+            except Exception as e:
+                logger.error('batch_item_error', request_id=request_id, index=index, error=str(e))
+                return {'index': index, 'id': item.id, 'error': 'Ошибка обработки текста'}
+        return {
+            'index': index,
+            'id': item.id,
+            'score': result['score'],
+            'models': result['scored_models'],
+            'windows': result['windows'],
+            'degraded': ticket.degraded,
+        }
+
+    async def stream_results():
+        tasks = [asyncio.create_task(score_item(index, item)) for index, item in enumerate(batch.items)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task, ensure_ascii=False) + '\n'
+        finally:
+            # Stop scoring if the client disconnects
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type='application/x-ndjson')
+
+
 class ShareRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=10000)
     score: float
@@ -286,7 +555,7 @@ class ShareRequest(BaseModel):
 async def share_text(request: ShareRequest):
     tokens_dict = [token.dict() for token in request.tokens]
 
-    record = db.create_record(
+    record_id = await db.create_record(
         request.text,
         tokens_dict,
         request.explanation,
@@ -294,12 +563,12 @@ async def share_text(request: ShareRequest):
         request.examples,
     )
 
-    return {'id': record['id']}
+    return {'id': record_id}
 
 
 @app.get('/api/v1/text/get')
 async def get_shared_text(id: str):
-    record = db.get_record_by_id(id)
+    record = await db.get_record_by_id(id)
     if not record:
         raise HTTPException(status_code=404, detail='Запись не найдена')
 
@@ -312,6 +581,47 @@ async def get_shared_text(id: str):
     }
 
 
+@app.get('/health/live')
+async def liveness():
+    # The process is up and the event loop answers, whether or not the model is loaded yet. A failed model load is
+    # not retried, so the process reports itself dead and the orchestrator restarts it
+    if model_loader.failed:
+        return JSONResponse(status_code=503, content={'status': 'failed', 'model': model_loader.status()})
+    return {'status': 'alive'}
+
+
+@app.get('/health/ready')
+async def readiness():
+    status = model_loader.status()
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content={'status': 'not_ready', 'model': status})
+    return {'status': 'ready', 'model': status}
+
+
+@app.get('/metrics')
+async def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Several workers: merge the samples every worker writes to the shared directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get('/api/v1/stats')
+async def get_stats():
+    model = model_loader.get() if model_loader.ready else None
+    return {
+        'model': model_loader.status(),
+        'transformer_batching': model.transformer_batcher.stats() if model else None,
+        'attribution_batching': model.attribution_batcher.stats() if model else None,
+        'result_cache': result_cache.stats(),
+        'extraction_pool': extraction_pool.stats(),
+        'admission': admission.stats(),
+    }
+
+
 if __name__ == '__main__':
     import uvicorn
 
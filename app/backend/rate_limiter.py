@@ -0,0 +1,173 @@
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+
+
+class RateLimitBackend(ABC):
+    """Token-bucket storage. `acquire` takes `cost` tokens from the bucket of `key` if it has enough.
+
+    Buckets hold at most `capacity` tokens and refill at `rate` tokens per second. Returns the number of seconds to
+    wait before retrying, or 0 if the request is allowed.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        pass
+
+    async def close(self):
+        pass
+
+
+def _take(tokens: float, updated_at: float, now: float, cost: float, capacity: float, rate: float):
+    # A bucket updated by another process with a slightly later clock must not lose tokens
+    tokens = min(capacity, tokens + max(now - updated_at, 0) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBackend(RateLimitBackend):
+    # Process-local buckets, for a single worker and for tests. Least recently seen keys are evicted first
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def acquire(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens, retry_after = _take(tokens, updated_at, now, cost, capacity, rate)
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SQLiteBackend(RateLimitBackend):
+    # Buckets shared by all workers on the host through one SQLite file
+
+    def __init__(self, path: str, cleanup_interval: float = 60.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)')
+        self._lock = threading.Lock()
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+
+    def _acquire(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes. The
+            # clock is read once the lock is held, so no process writes a later updated_at while this one waits
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = self._conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens, retry_after = _take(tokens, updated_at, now, cost, capacity, rate)
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)', (key, tokens, now)
+                )
+                if now - self._last_cleanup > self.cleanup_interval:
+                    # A bucket idle long enough to refill completely is the same as no bucket
+                    self._conn.execute('DELETE FROM buckets WHERE updated_at < ?', (now - capacity / rate,))
+                    self._last_cleanup = now
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return retry_after
+
+    async def acquire(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        return await asyncio.to_thread(self._acquire, key, cost, capacity, rate)
+
+    async def close(self):
+        self._conn.close()
+
+
+# Refill and take in one atomic step on the Redis server. Keys expire once the bucket would be full again
+_REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return tostring(retry_after)
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    # Buckets shared by all workers and hosts, works with any server speaking the Redis protocol
+
+    def __init__(self, url: str, prefix: str = 'rate_limit:'):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError('The Redis rate limit backend needs the redis package: pip install redis') from e
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_TOKEN_BUCKET)
+        self.prefix = prefix
+
+    async def acquire(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        retry_after = await self._script(keys=[self.prefix + key], args=[capacity, rate, cost, time.time()])
+        return float(retry_after)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class RateLimiter:
+    """Token-bucket limiter: `capacity` requests per `window` seconds on average, with bursts of up to `capacity`.
+
+    Requests cost 1 token unless `costs` gives a different weight for their path. Handlers that only know the
+    real cost of a request once it is parsed take the rest with `charge`.
+    """
+
+    def __init__(
+        self, backend: RateLimitBackend, capacity: float, window: float, costs: dict[str, float] | None = None
+    ):
+        self.backend = backend
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.costs = costs or {}
+
+    def cost(self, path: str) -> float:
+        return self.costs.get(path, 1.0)
+
+    async def acquire(self, key: str, path: str) -> int:
+        # Returns whole seconds to wait, 0 if the request may proceed
+        return await self.charge(key, self.cost(path))
+
+    async def charge(self, key: str, cost: float) -> int:
+        if cost <= 0:
+            return 0
+        return math.ceil(await self.backend.acquire(key, cost, self.capacity, self.rate))
+
+
+def create_backend(url: str) -> RateLimitBackend:
+    # 'memory', 'sqlite:///path/to/limits.db' or 'redis://host:6379/0'
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///') :])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBackend(url)
+    raise ValueError(f'Unsupported rate limit backend: {url}')
@@ -0,0 +1,430 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.backend.db_client import AirtableClient
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(ABC):
+    """Async storage for scoring records, users and the links between them."""
+
+    # Most records or links a bulk write sends in one request, None if the backend has no such limit
+    max_batch_size: Optional[int] = None
+
+    @abstractmethod
+    async def create_user(self, tg_id: Optional[str], login: Optional[str], password: Optional[str]) -> str:
+        pass
+
+    @abstractmethod
+    async def get_user_id_by_tg_id(self, tg_id: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def create_record(
+        self,
+        text: str,
+        tokens: List[Dict[str, float]],
+        explanation: str,
+        score: float,
+        examples: str,
+        record_id: Optional[str] = None,
+    ) -> str:
+        pass
+
+    @abstractmethod
+    async def link_user_to_record(self, user_id: str, record_id: str):
+        pass
+
+    async def create_records(self, records: List[Dict]):
+        # Bulk insert of normalized records, backends override this with a single round-trip
+        for record in records:
+            await self.create_record(**record)
+
+    async def link_users_to_records(self, links: List[tuple[str, str]]):
+        for user_id, record_id in links:
+            await self.link_user_to_record(user_id, record_id)
+
+    @abstractmethod
+    async def get_record_by_id(self, record_id: str) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    async def get_last_record(self) -> Optional[Dict]:
+        pass
+
+    @abstractmethod
+    async def get_last_record_by_tg_id(self, tg_id: str) -> Optional[Dict]:
+        pass
+
+    async def close(self):
+        pass
+
+
+class AirtableStorage(Storage):
+    # The pyairtable client is synchronous, so every call runs in a worker thread to keep the event loop free
+
+    max_batch_size = 10
+
+    def __init__(self, client: Optional[AirtableClient] = None):
+        self.client = client or AirtableClient()
+
+    async def create_user(self, tg_id: Optional[str], login: Optional[str], password: Optional[str]) -> str:
+        user = await asyncio.to_thread(self.client.create_user, tg_id, login, password)
+        return user['fields']['user_id']
+
+    async def get_user_id_by_tg_id(self, tg_id: str) -> Optional[str]:
+        return await asyncio.to_thread(self.client.get_user_id_by_tg_id, tg_id)
+
+    async def create_record(
+        self,
+        text: str,
+        tokens: List[Dict[str, float]],
+        explanation: str,
+        score: float,
+        examples: str,
+        record_id: Optional[str] = None,
+    ) -> str:
+        record = await asyncio.to_thread(
+            self.client.create_record, text, tokens, explanation, score, examples, record_id
+        )
+        return record['fields']['record_id']
+
+    async def link_user_to_record(self, user_id: str, record_id: str):
+        await asyncio.to_thread(self.client.link_user_to_record, user_id, record_id)
+
+    async def create_records(self, records: List[Dict]):
+        await asyncio.to_thread(self.client.create_records, records)
+
+    async def link_users_to_records(self, links: List[tuple[str, str]]):
+        await asyncio.to_thread(self.client.link_users_to_records, links)
+
+    async def get_record_by_id(self, record_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.client.get_record_by_id, record_id)
+
+    async def get_last_record(self) -> Optional[Dict]:
+        return await asyncio.to_thread(self.client.get_last_record)
+
+    async def get_last_record_by_tg_id(self, tg_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.client.get_last_record_by_tg_id, tg_id)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    tokens TEXT NOT NULL,
+    explanation TEXT,
+    score REAL NOT NULL,
+    examples TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE,
+    tg_id TEXT,
+    login TEXT,
+    password TEXT
+);
+CREATE INDEX IF NOT EXISTS users_tg_id ON users (tg_id);
+CREATE TABLE IF NOT EXISTS links (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    record_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_user_id ON links (user_id, id);
+"""
+
+
+class SQLiteStorage(Storage):
+    """Local storage on SQLite with a small pool of connections shared by worker threads."""
+
+    def __init__(self, path: str, pool_size: int = 4):
+        if path == ':memory:':
+            # Every pooled connection has to see the same in-memory database
+            path = f'file:storage-{uuid.uuid4().hex}?mode=memory&cache=shared'
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._pool: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(path, uri=path.startswith('file:'), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._pool.put(conn)
+        self._connections = list(self._pool.queue)
+
+        self._connections[0].executescript(SCHEMA)
+
+    def _call(self, func, *args):
+        conn = self._pool.get()
+        try:
+            with conn:
+                return func(conn, *args)
+        finally:
+            self._pool.put(conn)
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(self._call, func, *args)
+
+    @staticmethod
+    def _normalize_record(row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        return {
+            'record_id': row['record_id'],
+            'text': row['text'],
+            'explanation': row['explanation'],
+            'score': row['score'],
+            'tokens': json.loads(row['tokens']),
+            'examples': row['examples'],
+        }
+
+    async def create_user(self, tg_id: Optional[str], login: Optional[str], password: Optional[str]) -> str:
+        user_id = uuid.uuid4().hex
+        await self._run(
+            lambda conn: conn.execute(
+                'INSERT INTO users (user_id, tg_id, login, password) VALUES (?, ?, ?, ?)',
+                (user_id, str(tg_id) if tg_id else None, login, password),
+            )
+        )
+        return user_id
+
+    async def get_user_id_by_tg_id(self, tg_id: str) -> Optional[str]:
+        row = await self._run(
+            lambda conn: conn.execute('SELECT user_id FROM users WHERE tg_id = ? LIMIT 1', (str(tg_id),)).fetchone()
+        )
+        return row['user_id'] if row else None
+
+    async def create_record(
+        self,
+        text: str,
+        tokens: List[Dict[str, float]],
+        explanation: str,
+        score: float,
+        examples: str,
+        record_id: Optional[str] = None,
+    ) -> str:
+        record_id = record_id or uuid.uuid4().hex
+        await self.create_records(
+            [
+                {
+                    'record_id': record_id,
+                    'text': text,
+                    'tokens': tokens,
+                    'explanation': explanation,
+                    'score': score,
+                    'examples': examples,
+                }
+            ]
+        )
+        return record_id
+
+    async def create_records(self, records: List[Dict]):
+        now = time.time()
+        rows = [
+            (r['record_id'], r['text'], json.dumps(r['tokens']), r['explanation'], r['score'], r['examples'], now)
+            for r in records
+        ]
+        await self._run(
+            lambda conn: conn.executemany(
+                'INSERT INTO records (record_id, text, tokens, explanation, score, examples, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+        )
+
+    async def link_user_to_record(self, user_id: str, record_id: str):
+        await self.link_users_to_records([(user_id, record_id)])
+
+    async def link_users_to_records(self, links: List[tuple[str, str]]):
+        await self._run(lambda conn: conn.executemany('INSERT INTO links (user_id, record_id) VALUES (?, ?)', links))
+
+    async def get_record_by_id(self, record_id: str) -> Optional[Dict]:
+        row = await self._run(
+            lambda conn: conn.execute('SELECT * FROM records WHERE record_id = ?', (record_id,)).fetchone()
+        )
+        return self._normalize_record(row)
+
+    async def get_last_record(self) -> Optional[Dict]:
+        row = await self._run(lambda conn: conn.execute('SELECT * FROM records ORDER BY id DESC LIMIT 1').fetchone())
+        return self._normalize_record(row)
+
+    async def get_last_record_by_tg_id(self, tg_id: str) -> Optional[Dict]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                'SELECT records.* FROM users '
+                'JOIN links ON links.user_id = users.user_id '
+                'JOIN records ON records.record_id = links.record_id '
+                'WHERE users.tg_id = ? ORDER BY links.id DESC LIMIT 1',
+                (str(tg_id),),
+            ).fetchone()
+        )
+        return self._normalize_record(row)
+
+    async def close(self):
+        for conn in self._connections:
+            conn.close()
+
+
+class WriteBehindStorage(Storage):
+    """Buffers record and link inserts and writes them to `backend` in bulk in the background.
+
+    Record ids are generated up front, so callers get them immediately. Reads of records that are still buffered are
+    served from the buffer, by this process only: other workers see a record once it is flushed. Writes go out in
+    chunks of at most the backend's max_batch_size, and a failed chunk is retried alone with exponential backoff.
+    Items still failing after `max_retries` attempts stay queued for the next flush; `close` flushes what is left.
+    """
+
+    def __init__(self, backend: Storage, batch_size: int = 10, flush_interval: float = 0.5, max_retries: int = 5):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.chunk_size = min(batch_size, backend.max_batch_size or batch_size)
+
+        self._records: List[Dict] = []
+        self._links: List[tuple[str, str]] = []
+        self._pending: Dict[str, Dict] = {}
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def _schedule(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if len(self._records) + len(self._links) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _write(self, func, items: list) -> list:
+        # Writes `items` chunk by chunk, so a retry never sends a chunk that was already written again. Returns the
+        # items left unwritten, from the first chunk that failed every attempt
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start : start + self.chunk_size]
+            for attempt in range(self.max_retries):
+                try:
+                    await func(chunk)
+                    break
+                except Exception as e:
+                    if attempt + 1 == self.max_retries:
+                        logger.warning(f'Storage write of {len(chunk)} items failed ({e})')
+                        continue
+                    delay = min(2**attempt * 0.5, 30)
+                    logger.warning(f'Storage write of {len(chunk)} items failed ({e}), retrying in {delay}s')
+                    await asyncio.sleep(delay)
+            else:
+                logger.error(f'Keeping {len(items) - start} items queued after {self.max_retries} failed writes')
+                return items[start:]
+        return []
+
+    async def flush(self):
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            records, self._records = self._records, []
+            links, self._links = self._links, []
+            # Records go first so that links never point at a record that does not exist yet. Unwritten items go
+            # back to the front of the queues, ahead of anything added during the flush
+            if records:
+                failed = await self._write(self.backend.create_records, records)
+                for record in records[: len(records) - len(failed)]:
+                    self._pending.pop(record['record_id'], None)
+                self._records[:0] = failed
+                if failed:
+                    self._links[:0] = links
+                    return
+            if links:
+                self._links[:0] = await self._write(self.backend.link_users_to_records, links)
+
+    async def create_user(self, tg_id: Optional[str], login: Optional[str], password: Optional[str]) -> str:
+        return await self.backend.create_user(tg_id, login, password)
+
+    async def get_user_id_by_tg_id(self, tg_id: str) -> Optional[str]:
+        return await self.backend.get_user_id_by_tg_id(tg_id)
+
+    async def create_record(
+        self,
+        text: str,
+        tokens: List[Dict[str, float]],
+        explanation: str,
+        score: float,
+        examples: str,
+        record_id: Optional[str] = None,
+    ) -> str:
+        record = {
+            'record_id': record_id or uuid.uuid4().hex,
+            'text': text,
+            'tokens': tokens,
+            'explanation': explanation,
+            'score': score,
+            'examples': examples,
+        }
+        self._records.append(record)
+        self._pending[record['record_id']] = record
+        self._schedule()
+        return record['record_id']
+
+    async def link_user_to_record(self, user_id: str, record_id: str):
+        self._links.append((user_id, record_id))
+        self._schedule()
+
+    async def get_record_by_id(self, record_id: str) -> Optional[Dict]:
+        if record_id in self._pending:
+            return self._pending[record_id]
+        return await self.backend.get_record_by_id(record_id)
+
+    async def get_last_record(self) -> Optional[Dict]:
+        await self.flush()
+        return await self.backend.get_last_record()
+
+    async def get_last_record_by_tg_id(self, tg_id: str) -> Optional[Dict]:
+        await self.flush()
+        return await self.backend.get_last_record_by_tg_id(tg_id)
+
+    async def close(self):
+        # Let the background flusher finish its current write instead of cancelling it halfway
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            self._wakeup.set()
+            await self._task
+        await self.flush()
+        if self._records or self._links:
+            logger.error(f'Closing with {len(self._records)} records and {len(self._links)} links not written')
+        await self.backend.close()
+
+
+def create_storage(url: str, write_behind: bool = False, batch_size: int = 10, flush_interval: float = 0.5) -> Storage:
+    # 'airtable', or SQLAlchemy-style 'sqlite:///relative.db', 'sqlite:////absolute.db', 'sqlite:///:memory:'
+    if url == 'airtable':
+        storage = AirtableStorage()
+    elif url.startswith('sqlite:///'):
+        storage = SQLiteStorage(url[len('sqlite:///') :])
+    else:
+        raise ValueError(f'Unsupported storage url: {url}')
+
+    if write_behind:
+        storage = WriteBehindStorage(storage, batch_size=batch_size, flush_interval=flush_interval)
+    return storage
@@ -1,5 +1,6 @@
 
 from io import BytesIO
+from typing import Iterable, Iterator, Optional
 
 import docx
 import PyPDF2
@@ -12,30 +13,58 @@ def extract_text_from_txt(content: bytes) -> str:
     return content.decode('utf-8')
 
 
-def extract_text_from_docx(content: bytes) -> str:
+class TextTooLong(ValueError):
+    pass
+
+
+def take_text(chunks: Iterable[str], max_chars: Optional[int] = None, truncate: bool = True) -> str:
+    # Stops consuming `chunks` as soon as the budget is reached, so the rest of the document is never parsed
+    parts = []
+    length = 0
+    for chunk in chunks:
+        if max_chars is not None and length + len(chunk) > max_chars:
+            if not truncate:
+                raise TextTooLong(f'Extracted text exceeds {max_chars} characters')
+            parts.append(chunk[: max_chars - length])
+            break
+        parts.append(chunk)
+        length += len(chunk)
+    return ''.join(parts)
+
+
+def _join(lines: Iterable[str], separator: str = '\n') -> Iterator[str]:
+    for i, line in enumerate(lines):
+        yield separator + line if i else line
+
+
+def iter_text_from_docx(content: bytes) -> Iterator[str]:
     doc = docx.Document(BytesIO(content))
-    return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+    yield from _join(paragraph.text for paragraph in doc.paragraphs)
 
 
-def extract_text_from_pdf(content: bytes) -> str:
+def iter_text_from_pdf(content: bytes) -> Iterator[str]:
     pdf_file = BytesIO(content)
     pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = ''
+    # Pages are parsed lazily, one at a time
     for page in pdf_reader.pages:
-        text += page.extract_text() + '\n'
-    return text
+        yield page.extract_text() + '\n'
 
 
-def extract_text_from_pptx(content: bytes) -> str:
+def iter_text_from_pptx(content: bytes) -> Iterator[str]:
     prs = Presentation(BytesIO(content))
-    text = []
+    yield from _join(shape.text for slide in prs.slides for shape in slide.shapes if hasattr(shape, 'text'))
 
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, 'text'):
-                text.append(shape.text)
 
-    return '\n'.join(text)
+def extract_text_from_docx(content: bytes, max_chars: Optional[int] = None, truncate: bool = True) -> str:
+    return take_text(iter_text_from_docx(content), max_chars, truncate)
+
+
+def extract_text_from_pdf(content: bytes, max_chars: Optional[int] = None, truncate: bool = True) -> str:
+    return take_text(iter_text_from_pdf(content), max_chars, truncate)
+
+
+def extract_text_from_pptx(content: bytes, max_chars: Optional[int] = None, truncate: bool = True) -> str:
+    return take_text(iter_text_from_pptx(content), max_chars, truncate)
 
 
 # TODO: extract text from image using Gemini
@@ -58,3 +87,23 @@ def extract_text_from_image(content: bytes) -> str:
         return text.strip()
     except Exception as e:
         raise ValueError(f'Failed to process image: {str(e)}')
+
+
+DOCUMENT_EXTRACTORS = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': extract_text_from_docx,
+    'application/pdf': extract_text_from_pdf,
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': extract_text_from_pptx,
+}
+
+
+def extract_text(mime_type: str, content: bytes, max_chars: Optional[int] = None, truncate: bool = True) -> str:
+    if mime_type in DOCUMENT_EXTRACTORS:
+        return DOCUMENT_EXTRACTORS[mime_type](content, max_chars, truncate)
+    if mime_type.startswith('image/'):
+        text = extract_text_from_image(content)
+    elif mime_type == 'text/plain':
+        text = extract_text_from_txt(content)
+    else:
+        raise ValueError(f'Unsupported MIME type: {mime_type}')
+    # OCR and plain text cannot stop early, the budget is applied to the result
+    return take_text([text], max_chars, truncate)
@@ -22,7 +22,8 @@ from dotenv import load_dotenv
 project_root = Path(__file__).parent.parent.parent
 sys.path.append(str(project_root))
 
-from app.backend.db_client import AirtableClient
+from app.backend.config import STORAGE_BATCH_SIZE, STORAGE_FLUSH_INTERVAL, STORAGE_URL, STORAGE_WRITE_BEHIND
+from app.backend.storage import create_storage
 
 load_dotenv()
 API_URL = os.getenv('BACKEND_URL', 'https://dw25.vladimirskvortsov.com')
@@ -33,7 +34,12 @@ if not TOKEN:
 logging.basicConfig(level=logging.INFO)
 bot = Bot(token=TOKEN)
 dp = Dispatcher(bot, storage=MemoryStorage())
-db = AirtableClient()
+db = create_storage(
+    STORAGE_URL,
+    write_behind=STORAGE_WRITE_BEHIND,
+    batch_size=STORAGE_BATCH_SIZE,
+    flush_interval=STORAGE_FLUSH_INTERVAL,
+)
 
 
 class Form(StatesGroup):
@@ -53,10 +59,10 @@ def main_menu() -> ReplyKeyboardMarkup:
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
     user = message.from_user
-    user_id = db.get_user_id_by_tg_id(str(user.id))
+    user_id = await db.get_user_id_by_tg_id(str(user.id))
     if not user_id:
-        rec = db.create_user(tg_id=str(user.id), login=None, password=None)
-        logging.info(f'Created new user: {rec}')
+        user_id = await db.create_user(tg_id=str(user.id), login=None, password=None)
+        logging.info(f'Created new user: {user_id}')
 
     await message.answer('Добро пожаловать! Выберите действие:', reply_markup=main_menu())
 
@@ -138,11 +144,12 @@ async def handle_file(message: types.Message, state: FSMContext):
         await bot.send_message(message.chat.id, 'Ошибка при разборе. Повторите запрос', reply_markup=main_menu())
 
         await state.finish()
-    rec = db.create_record(result['text'], result['tokens'], result['explanation'], result['score'], result['examples'])
-    record_id = rec['fields']['record_id']
+    record_id = await db.create_record(
+        result['text'], result['tokens'], result['explanation'], result['score'], result['examples']
+    )
 
-    id = str(db.get_user_id_by_tg_id(message.from_user.id))
-    db.link_user_to_record(user_id=id, record_id=record_id)
+    id = str(await db.get_user_id_by_tg_id(message.from_user.id))
+    await db.link_user_to_record(user_id=id, record_id=record_id)
 
     await process_analysis(message.chat.id, result['score'], record_id)
     await bot.send_message(message.chat.id, 'Готов к использованию 😃', reply_markup=main_menu())
@@ -157,11 +164,12 @@ async def handle_text(message: types.Message, state: FSMContext):
     async with aiohttp.ClientSession() as session:
         resp = await session.post(f'{API_URL}/api/v1/score/text', json={'text': text, 'models': ['gpt', 'claude']})
         result = await resp.json()
-    rec = db.create_record(text, result['tokens'], result['explanation'], result['score'], result['examples'])
-    record_id = rec['fields']['record_id']
+    record_id = await db.create_record(
+        text, result['tokens'], result['explanation'], result['score'], result['examples']
+    )
 
-    id = str(db.get_user_id_by_tg_id(message.from_user.id))
-    db.link_user_to_record(user_id=str(id), record_id=record_id)
+    id = str(await db.get_user_id_by_tg_id(message.from_user.id))
+    await db.link_user_to_record(user_id=str(id), record_id=record_id)
 
     await process_analysis(message.chat.id, result['score'], record_id)
     await bot.send_message(message.chat.id, 'Готов к использованию 😃', reply_markup=main_menu())
@@ -172,7 +180,7 @@ async def handle_text(message: types.Message, state: FSMContext):
 @dp.callback_query_handler(lambda c: c.data.startswith(('text:', 'expl:', 'tokens:', 'examp:')))
 async def cb_show(cq: types.CallbackQuery):
     action, record_id = cq.data.split(':', 1)
-    record = db.get_record_by_id(record_id)
+    record = await db.get_record_by_id(record_id)
     tokens = [
         t
         for t in record['tokens']
@@ -208,5 +216,10 @@ async def cb_delete(cq: types.CallbackQuery):
     await cq.answer()
 
 
+async def on_shutdown(dispatcher: Dispatcher):
+    # Flush buffered records before exiting
+    await db.close()
+
+
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True)
+    executor.start_polling(dp, skip_updates=True, on_shutdown=on_shutdown)
@@ -32,6 +32,9 @@ class S3Client:
         buffer.seek(0)
         self.s3.upload_fileobj(buffer, self.bucket, key)
 
+    def upload_file(self, path: str, key: str):
+        self.s3.upload_file(path, self.bucket, key)
+
     def download_df(self, key: str) -> pd.DataFrame:
         buffer = BytesIO()
         self.s3.download_fileobj(self.bucket, key, buffer)
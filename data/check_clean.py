@@ -0,0 +1,133 @@
+"""Checks that utils.clean gives the same output as the original implementation and measures both in rows/s.
+
+Inputs are the texts of --data (raw provider exports are the most telling) plus --fuzz random strings made of the
+characters the cleaner treats specially: spaces around punctuation, full-width punctuation, apostrophes, newlines.
+An input on which the original raised must raise the same exception type.
+
+Usage (from data/): python check_clean.py --data merged.csv --fuzz 100000
+"""
+
+import argparse
+import random
+import time
+
+import pandas as pd
+import utils
+
+FUZZ_ALPHABET = (
+    list("    ,.;:?!'\n")
+    + ['a', 'b', 's', 't', 'я', 'ж', '1', '_', '²', 'n', "n't"]
+    + ['……', '。', '，', '；', '：', '？', '！', '“', '”', '‘', '’', '（', '）', '【', '】', '、', '…', '. . . ']
+)
+
+
+def _legacy_repl(data: str, fromjiao: list[str], tojiao: list[str]) -> str:
+    assert len(fromjiao) == len(tojiao)
+    for i, j in zip(fromjiao, tojiao):
+        data = data.replace(i, j)
+    return data
+
+
+def _legacy_process(line: str) -> str:
+    new_line = line.replace('\n', ' ')
+    p1 = [',', '.', ';', ':', '?', '!']
+    for _ in range(5):
+        for p in p1:
+            new_line = new_line.replace(' ' + p + ' ', p)
+            new_line = new_line.replace(p + ' ', p)
+            new_line = new_line.replace(' ' + p, p)
+
+    for p in p1:
+        new_line = new_line.replace(p, p + ' ')
+    new_line = new_line.replace('. . . ', '... ')
+    wrong_samples = []
+    for i in range(1, len(new_line) - 2):
+        if new_line[i] == "'" and new_line[i + 1].isalpha() and new_line[i - 1] == ' ' and new_line[i + 2] == ' ':
+            j = i - 2
+            while j >= 1 and new_line[j] == ' ':
+                j -= 1
+
+            wrong_samples.append(new_line[j : i + 3])
+    wrong_samples.sort(key=lambda x: len(x), reverse=True)
+    for w in wrong_samples:
+        new_line = new_line.replace(w, w[0] + w[-3:])
+    new_line = new_line.replace(" n't", "n't")
+    for k in range(len(new_line) - 1, -1, -1):
+        if new_line[k] != ' ':
+            new_line = new_line[: k + 1]
+            break
+    return new_line
+
+
+def legacy_clean(data: str) -> str:
+    # utils.clean as it was before it moved to translate tables and regexes
+    d = _legacy_repl(data, utils._quanjiao2b, utils._banjiao)
+    d = _legacy_process(d)
+    new_d = d.replace('  ', ' ')
+    while new_d != d:
+        d = new_d
+        new_d = d.replace('  ', ' ')
+    return new_d
+
+
+def fuzz_texts(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [''.join(rng.choices(FUZZ_ALPHABET, k=rng.randint(0, 40))) for _ in range(count)]
+
+
+def _outcome(func, text: str):
+    try:
+        return func(text)
+    except Exception as e:
+        return type(e)
+
+
+def rows_per_second(func, texts: list[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            _outcome(func, text)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare utils.clean with the original implementation')
+    parser.add_argument('--data', help='CSV with a text column')
+    parser.add_argument('--rows', type=int, help='Use only the first rows of --data')
+    parser.add_argument('--fuzz', type=int, default=50_000, help='Random strings to compare')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs, the best one is reported')
+    args = parser.parse_args()
+
+    corpus = []
+    if args.data:
+        corpus = pd.read_csv(args.data, lineterminator='\n', nrows=args.rows)['text'].astype(str).tolist()
+    fuzz = fuzz_texts(args.fuzz)
+
+    mismatches = 0
+    for text in corpus + fuzz:
+        old, new = _outcome(legacy_clean, text), _outcome(utils.clean, text)
+        if old != new:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f'Mismatch for {text!r}:\n  original {old!r}\n  new      {new!r}')
+    print(f'Compared {len(corpus)} texts and {len(fuzz)} random strings, {mismatches} mismatches')
+
+    if corpus:
+        chars = sum(map(len, corpus)) / len(corpus)
+        old = rows_per_second(legacy_clean, corpus, args.repeat)
+        new = rows_per_second(utils.clean, corpus, args.repeat)
+        print(f'{len(corpus)} rows, {chars:.0f} characters on average')
+        print(f'original {old:10.0f} rows/s')
+        print(f'new      {new:10.0f} rows/s  ({new / old:.1f}x)')
+        start = time.perf_counter()
+        utils.clean_column(pd.Series(corpus))
+        print(f'column   {len(corpus) / (time.perf_counter() - start):10.0f} rows/s')
+
+    if mismatches:
+        raise SystemExit(f'{mismatches} texts are cleaned differently')
+
+
+if __name__ == '__main__':
+    main()
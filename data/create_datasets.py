@@ -3,7 +3,8 @@ import os
 import uuid
 
 from providers import KaggleProvider, HuggingFaceProvider, FileProvider, KaggleCompetitionProvider, KaggleTxtProvider
-import pandas as pd
+from pipeline import build_providers, print_merge_report, stream_merge, stream_sample
+from near_dedup import THRESHOLD, find_clusters
 from dotenv import load_dotenv
 from S3Client import S3Client
 
@@ -21,6 +22,22 @@ parser.add_argument(
     default=False,
 )
 parser.add_argument('-u', '--upload-to-s3', action='store_true', help='Upload datasets to s3', default=False)
+parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Providers built in parallel')
+parser.add_argument(
+    '--split-workers', type=int, help='Processes splitting long texts per provider, CPU count / workers by default'
+)
+parser.add_argument('--checkpoint-dir', default='checkpoints', help='Where finished providers are kept for resuming')
+parser.add_argument('--rebuild', action='store_true', help='Ignore existing checkpoints', default=False)
+parser.add_argument(
+    '--near-dup',
+    choices=['drop', 'tag', 'off'],
+    default='drop',
+    help='Near duplicates: keep the first of each cluster, keep all with a cluster_id column, or skip the stage',
+)
+parser.add_argument('--near-dup-threshold', type=float, default=THRESHOLD, help='Estimated Jaccard similarity')
+parser.add_argument(
+    '--provider-cache', action='store_true', help='Load and store built providers in the S3 cache', default=False
+)
 
 our_namespace = parser.parse_args()
 
@@ -180,30 +197,54 @@ s3_client = S3Client()
 S3_MERGED_PATH = s3_client.get_cache_key('merged')
 S3_SAMPLE_PATH = s3_client.get_cache_key('merged_sample')
 
-merged_df = None
-sample_df = None
+SAMPLE_SIZE = 250
+
 if our_namespace.use_s3:
     merged_df = s3_client.download_df(S3_MERGED_PATH)
     sample_df = s3_client.download_df(S3_SAMPLE_PATH)
     print('Successfully downloaded datasets from S3')
-else:
-    print('Creating datasets locally...')
 
-    # datasets_df = [dataset.get_df() for dataset in datasets]
-    # merged_df = pd.concat(datasets_df, ignore_index=True)
-    # merged_df = merged_df.drop_duplicates(subset=['text']).reset_index(drop=True)
-    merged_df = pd.read_csv('merged.csv', lineterminator='\n')
+    if our_namespace.upload_to_s3:
+        s3_client.upload_df(merged_df, S3_MERGED_PATH)
+        s3_client.upload_df(sample_df, S3_SAMPLE_PATH)
+        print('Successfully created and uploaded datasets to S3')
 
-    SAMPLE_SIZE = 250
-    sample_df = merged_df.sample(n=SAMPLE_SIZE, random_state=0)
+    # Save locally
+    merged_df.to_csv('merged.csv', index=False)
+    sample_df.to_csv('merged_sample.csv', index=False)
+    merged_size = len(merged_df)
+else:
+    print('Creating datasets locally...')
 
-if our_namespace.upload_to_s3:
-    s3_client.upload_df(merged_df, S3_MERGED_PATH)
-    s3_client.upload_df(sample_df, S3_SAMPLE_PATH)
-    print('Successfully created and uploaded datasets to S3')
+    # Providers are built in parallel and checkpointed, then concatenated and deduplicated in a streaming pass
+    checkpoints = build_providers(
+        datasets,
+        our_namespace.checkpoint_dir,
+        workers=our_namespace.workers,
+        use_cache=our_namespace.provider_cache,
+        rebuild=our_namespace.rebuild,
+        split_workers=our_namespace.split_workers or max(1, (os.cpu_count() or 1) // our_namespace.workers),
+    )
+    clusters = None
+    if our_namespace.near_dup != 'off':
+        clusters = find_clusters(
+            checkpoints, our_namespace.checkpoint_dir, our_namespace.workers, our_namespace.near_dup_threshold
+        )
+    report = stream_merge(
+        checkpoints,
+        'merged.csv',
+        parquet_path='merged.parquet' if our_namespace.upload_to_s3 else None,
+        clusters=clusters,
+        drop_near_duplicates=our_namespace.near_dup == 'drop',
+    )
+    print_merge_report(report, [provider.dataset_id for provider in datasets])
+    merged_size = sum(stats['kept'] for stats in report)
+    sample_df = stream_sample('merged.csv', merged_size, n=min(SAMPLE_SIZE, merged_size), random_state=0)
+    sample_df.to_csv('merged_sample.csv', index=False)
 
-# Save locally
-merged_df.to_csv('merged.csv', index=False)
-sample_df.to_csv('merged_sample.csv', index=False)
+    if our_namespace.upload_to_s3:
+        s3_client.upload_file('merged.parquet', S3_MERGED_PATH)
+        s3_client.upload_df(sample_df, S3_SAMPLE_PATH)
+        print('Successfully created and uploaded datasets to S3')
 
-print(f'Dataframe size: {len(merged_df)}')
+print(f'Dataframe size: {merged_size}')
@@ -0,0 +1,155 @@
+"""Near-duplicate detection over the provider checkpoints with MinHash and LSH.
+
+Every text gets a MinHash signature of its character shingles, written to a memory-mapped .npy file, so memory does
+not grow with the corpus beyond a few arrays of one integer per row. Signatures are cut into bands; rows that share
+a band are candidates, and candidates whose signatures agree on at least `threshold` of the hashes (the estimated
+Jaccard similarity) are joined into one cluster. The cluster ID of a row is the position of the first row of its
+cluster in checkpoint order, so keeping the rows whose cluster ID is their own position keeps first occurrences,
+like drop_duplicates does.
+"""
+
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pyarrow.parquet as pq
+
+NUM_PERM = 128
+# 16 bands of 8 hashes: a pair at 0.8 similarity shares a band with probability 0.95, a pair at 0.5 with 0.06
+BANDS = 16
+SHINGLE_SIZE = 5
+THRESHOLD = 0.8
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_BASE = np.uint64(1_000_003)
+
+
+def permutations(num_perm: int = NUM_PERM, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    # 32-bit hashes of the distinct character `size`-grams of the lowercased text, whitespace runs count as one
+    codes = np.frombuffer(' '.join(text.lower().split()).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        codes = np.zeros(1, dtype=np.uint64)
+    size = min(size, len(codes))
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for j in range(size):
+        hashes = hashes * _BASE + codes[j : j + count]  # wraps around modulo 2**64
+    return np.unique(hashes >> np.uint64(32))
+
+
+def minhash(texts: list[str], a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    signatures = np.empty((len(texts), len(a)), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        hashes = shingle_hashes(text)
+        signatures[i] = (((a[:, None] * hashes[None, :] + b[:, None]) % _MERSENNE) & _MAX_HASH).min(axis=1)
+    return signatures
+
+
+def _minhash_batch(texts: list[str], num_perm: int) -> np.ndarray:
+    return minhash(texts, *permutations(num_perm))
+
+
+def build_signatures(
+    paths: list[Path], output: Path, workers: int, num_perm: int = NUM_PERM, batch_size: int = 10_000
+) -> np.ndarray:
+    """MinHash signatures of every row of the checkpoints, in order, as a (rows, num_perm) memory-mapped array.
+
+    Batches are read one by one and hashed in a process pool; at most two batches per worker are in flight.
+    """
+    rows = sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+    signatures = np.lib.format.open_memmap(output, mode='w+', dtype=np.uint32, shape=(rows, num_perm))
+
+    def batches():
+        for path in paths:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=['text']):
+                yield batch.column('text').to_pylist()
+
+    offset = 0
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork')) as pool:
+        for texts in batches():
+            pending.append((offset, pool.submit(_minhash_batch, texts, num_perm)))
+            offset += len(texts)
+            while len(pending) >= 2 * workers or (pending and pending[0][1].done()):
+                start, future = pending.pop(0)
+                result = future.result()
+                signatures[start : start + len(result)] = result
+        for start, future in pending:
+            result = future.result()
+            signatures[start : start + len(result)] = result
+
+    signatures.flush()
+    return signatures
+
+
+def _band_edges(path: Path, band: int, bands: int, threshold: float, chunk_rows: int = 1_000_000) -> np.ndarray:
+    # Pairs of rows that share this band, compared neighbour by neighbour in key order, with enough agreement
+    signatures = np.load(path, mmap_mode='r')
+    rows, num_perm = signatures.shape
+    width = num_perm // bands
+    keys = np.empty(rows, dtype=np.uint64)
+    for start in range(0, rows, chunk_rows):
+        block = np.asarray(signatures[start : start + chunk_rows, band * width : (band + 1) * width], dtype=np.uint64)
+        key = np.zeros(len(block), dtype=np.uint64)
+        for column in block.T:
+            key = key * _BASE + column
+        keys[start : start + len(block)] = key
+
+    order = np.argsort(keys, kind='stable')
+    same = keys[order[1:]] == keys[order[:-1]]
+    left, right = order[:-1][same], order[1:][same]
+
+    edges = [np.empty((0, 2), dtype=np.int64)]
+    pairs_per_chunk = chunk_rows // 10
+    for start in range(0, len(left), pairs_per_chunk):
+        u, v = left[start : start + pairs_per_chunk], right[start : start + pairs_per_chunk]
+        similar = (signatures[u] == signatures[v]).mean(axis=1) >= threshold
+        edges.append(np.stack([u[similar], v[similar]], axis=1))
+    return np.concatenate(edges)
+
+
+def connected_components(rows: int, edges: np.ndarray) -> np.ndarray:
+    # Label of every row: the smallest row in its component. Minimum propagation along the edges, then pointer
+    # jumping, until nothing changes
+    labels = np.arange(rows, dtype=np.int64)
+    if len(edges) == 0:
+        return labels
+    u, v = edges[:, 0], edges[:, 1]
+    while True:
+        lowest = np.minimum(labels[u], labels[v])
+        before = labels.copy()
+        np.minimum.at(labels, u, lowest)
+        np.minimum.at(labels, v, lowest)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, before):
+            return labels
+
+
+def find_clusters(
+    paths: list[Path], work_dir: str, workers: int, threshold: float = THRESHOLD, bands: int = BANDS
+) -> np.ndarray:
+    """Cluster ID of every row of the checkpoints, in order: the position of the first row of its cluster."""
+    signatures_path = Path(work_dir) / 'signatures.npy'
+    signatures = build_signatures(paths, signatures_path, workers)
+    rows = len(signatures)
+    del signatures
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork')) as pool:
+        futures = [pool.submit(_band_edges, signatures_path, band, bands, threshold) for band in range(bands)]
+        edges = np.concatenate([future.result() for future in futures]).astype(np.int64)
+
+    signatures_path.unlink()
+    return connected_components(rows, np.unique(edges, axis=0))
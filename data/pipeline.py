@@ -0,0 +1,161 @@
+import hashlib
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from providers import Provider
+
+COLUMNS = ['id', 'text', 'is_human', 'lang']
+SCHEMA = pa.schema([('id', pa.string()), ('text', pa.string()), ('is_human', pa.int64()), ('lang', pa.string())])
+
+# Transform functions are lambdas and cannot be pickled, so forked workers inherit the providers from here
+_providers: list[Provider] = []
+
+
+def checkpoint_path(checkpoint_dir: str, provider: Provider) -> Path:
+    return Path(checkpoint_dir) / provider.s3.get_cache_key(provider.dataset_id)
+
+
+def _build_provider(index: int, checkpoint_dir: str, use_cache: bool, split_workers: int) -> int:
+    provider = _providers[index]
+    df = provider.get_df(split_workers) if use_cache else provider.build_df(split_workers)
+
+    # Written under a temporary name first, so an interrupted build never leaves a checkpoint that looks complete
+    path = checkpoint_path(checkpoint_dir, provider)
+    tmp_path = path.with_name(path.name + '.tmp')
+    df[COLUMNS].to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return len(df)
+
+
+def build_providers(
+    providers: list[Provider],
+    checkpoint_dir: str,
+    workers: int,
+    use_cache: bool = False,
+    rebuild: bool = False,
+    split_workers: int = 1,
+) -> list[Path]:
+    """Downloads, transforms and filters every provider in a process pool, one parquet checkpoint per provider.
+
+    Providers that already have a checkpoint are skipped unless `rebuild` is set, so a failed build resumes where
+    it stopped. Each provider splits its long texts with `split_workers` processes of its own. Returns the
+    checkpoint paths in provider order.
+    """
+    global _providers
+    _providers = providers
+
+    Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    paths = [checkpoint_path(checkpoint_dir, provider) for provider in providers]
+    pending = [i for i, path in enumerate(paths) if rebuild or not path.exists()]
+    for i in set(range(len(providers))) - set(pending):
+        print(f'Using checkpoint for {providers[i].dataset_id}')
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork')) as pool:
+        futures = {pool.submit(_build_provider, i, checkpoint_dir, use_cache, split_workers): i for i in pending}
+        for future in as_completed(futures):
+            dataset_id = providers[futures[future]].dataset_id
+            try:
+                print(f'Built {dataset_id}: {future.result()} rows')
+            except Exception as e:
+                print(f'Failed to build {dataset_id}: {e}')
+                failed.append(dataset_id)
+
+    if failed:
+        raise RuntimeError(f'Failed to build {", ".join(failed)}. Run again to resume, finished providers are kept')
+    return paths
+
+
+def _text_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def stream_merge(
+    paths: list[Path],
+    csv_path: str,
+    parquet_path: str | None = None,
+    batch_size: int = 50_000,
+    clusters: np.ndarray | None = None,
+    drop_near_duplicates: bool = False,
+) -> list[dict]:
+    """Concatenates the checkpoints into `csv_path` (and `parquet_path`) batch by batch, dropping duplicate texts.
+
+    Same result as concatenating all frames and calling drop_duplicates(subset=['text']), but only one batch and
+    a 16-byte digest per distinct text are held in memory. With `clusters` (see near_dedup.find_clusters) the
+    cluster IDs are written as a `cluster_id` column, and with `drop_near_duplicates` only the first row of every
+    cluster is kept. Returns the rows read, dropped and kept per checkpoint.
+    """
+    schema = SCHEMA if clusters is None else SCHEMA.append(pa.field('cluster_id', pa.int64()))
+    seen = set()
+    report = []
+    rows = 0
+    position = 0
+    tmp_csv = f'{csv_path}.tmp'
+    writer = pq.ParquetWriter(f'{parquet_path}.tmp', schema) if parquet_path else None
+    try:
+        with open(tmp_csv, 'w', encoding='utf-8', newline='') as out:
+            for path in paths:
+                stats = {'checkpoint': path.name, 'rows': 0, 'exact_duplicates': 0, 'near_duplicates': 0}
+                for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=COLUMNS):
+                    df = batch.to_pandas().astype({'is_human': 'int64'})
+                    keep = []
+                    for digest in map(_text_digest, df['text']):
+                        keep.append(digest not in seen)
+                        seen.add(digest)
+                    keep = np.array(keep, dtype=bool)
+                    stats['rows'] += len(df)
+                    stats['exact_duplicates'] += int((~keep).sum())
+
+                    if clusters is not None:
+                        df['cluster_id'] = clusters[position : position + len(df)]
+                        if drop_near_duplicates:
+                            first = df['cluster_id'].to_numpy() == np.arange(position, position + len(df))
+                            stats['near_duplicates'] += int((keep & ~first).sum())
+                            keep &= first
+                    position += len(df)
+                    df = df[keep]
+
+                    df.to_csv(out, header=rows == 0, index=False)
+                    if writer is not None:
+                        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                    rows += len(df)
+                report.append({**stats, 'kept': stats['rows'] - stats['exact_duplicates'] - stats['near_duplicates']})
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_csv, csv_path)
+    if parquet_path:
+        os.replace(f'{parquet_path}.tmp', parquet_path)
+    return report
+
+
+def print_merge_report(report: list[dict], names: list[str]):
+    print(f'{"source":<64} {"rows":>9} {"exact dup":>9} {"near dup":>9} {"kept":>9} {"lost":>6}')
+    for name, stats in zip(names, report):
+        lost = 1 - stats['kept'] / stats['rows'] if stats['rows'] else 0.0
+        print(
+            f'{name:<64} {stats["rows"]:>9} {stats["exact_duplicates"]:>9} {stats["near_duplicates"]:>9} '
+            f'{stats["kept"]:>9} {lost:>6.1%}'
+        )
+
+
+def stream_sample(csv_path: str, total_rows: int, n: int, random_state: int = 0, chunksize: int = 100_000):
+    # The same rows, in the same order, as pd.read_csv(csv_path).sample(n=n, random_state=random_state), reading
+    # the file in chunks
+    positions = np.random.RandomState(random_state).choice(total_rows, size=n, replace=False)
+    wanted = np.sort(positions)
+
+    parts = []
+    offset = 0
+    for chunk in pd.read_csv(csv_path, lineterminator='\n', chunksize=chunksize):
+        local = wanted[(wanted >= offset) & (wanted < offset + len(chunk))] - offset
+        parts.append(chunk.iloc[local].set_axis(local + offset))
+        offset += len(chunk)
+    return pd.concat(parts).loc[positions]
@@ -1,9 +1,11 @@
 import os
+import multiprocessing as mp
 import kagglehub
 import pandas as pd
 import utils
 import glob
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Callable
 from charset_normalizer import from_bytes
@@ -23,50 +25,58 @@ text_splitter = RecursiveCharacterTextSplitter(
 )
 
 
+def _split_partition(texts: list[str]) -> list[list[str]]:
+    return [text_splitter.split_text(text) for text in texts]
+
+
+def split_texts(texts: list[str], workers: int = 1, partition_size: int = 256) -> list[list[str]]:
+    # Chunks of every text, in order. Partitions go to forked workers, which already have the splitter
+    if workers <= 1 or len(texts) <= partition_size:
+        return _split_partition(texts)
+    partitions = [texts[i : i + partition_size] for i in range(0, len(texts), partition_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork')) as pool:
+        return [chunks for partition in pool.map(_split_partition, partitions) for chunks in partition]
+
+
 class Provider(ABC):
     def __init__(self, dataset_id: str, transform_func: Callable[[pd.DataFrame], pd.DataFrame]):
         self.dataset_id = dataset_id
         self.transform_func = transform_func
         self.s3 = S3Client()
 
-    def _filter(self, df: pd.DataFrame) -> pd.DataFrame:
-        df['text_clean'] = df['text'].astype(str).apply(utils.clean)
+    def _filter(self, df: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+        df['text_clean'] = utils.clean_column(df['text'])
         df = df.drop_duplicates(subset=['text_clean']).reset_index(drop=True)
         df['text'] = df['text_clean']
         df = df.drop(columns=['text_clean'])
 
-        # Process texts and create new rows for split texts
-        new_rows = []
-        for _, row in df.iterrows():
-            text = row['text']
-            if len(text) >= 2000:  # Only split texts longer than 2000 characters
-                chunks = text_splitter.split_text(text)
-                for chunk in chunks:
-                    if len(chunk) >= 80:  # Keep only chunks that meet minimum length
-                        new_row = row.copy()
-                        new_row['text'] = chunk
-                        new_rows.append(new_row)
-            elif len(text) >= 80:  # Keep original texts that meet minimum length
-                new_rows.append(row)
-
-        # Create new dataframe with split texts
-        return pd.DataFrame(new_rows).reset_index(drop=True)
-
-    def get_df(self) -> pd.DataFrame:
-        cache_key: str = self.s3.get_cache_key(self.dataset_id)
-
-        if self.s3.exists(cache_key):
-            print(f'Loading {self.dataset_id} from cache')
-            return self.s3.download_df(cache_key)
+        # Texts of 2000 characters and more become lists of chunks, explode() turns every chunk into a row of its
+        # own next to the rest of the row. Shorter texts and chunks alike are kept from 80 characters.
+        texts = df['text'].tolist()
+        chunks = iter(split_texts([text for text in texts if len(text) >= 2000], workers))
+        df['text'] = [next(chunks) if len(text) >= 2000 else text for text in texts]
+        df = df.explode('text')
+        return df[df['text'].str.len() >= 80].reset_index(drop=True)
 
+    def build_df(self, workers: int = 1) -> pd.DataFrame:
         print(f'Downloading and transforming {self.dataset_id}')
         df = self._download()
         df = self.transform_func(df)
 
-        df = self._filter(df)
+        df = self._filter(df, workers)
 
         if '__index_level_0__' in df.columns:
             df = df.drop(columns=['__index_level_0__'])
+        return df
+
+    def get_df(self, workers: int = 1) -> pd.DataFrame:
+        cache_key: str = self.s3.get_cache_key(self.dataset_id)
+
+        if self.s3.exists(cache_key):
+            print(f'Loading {self.dataset_id} from cache')
+            return self.s3.download_df(cache_key)
+
+        df = self.build_df(workers)
 
         print(f'Caching {self.dataset_id} {cache_key}')
         self.s3.upload_df(df, cache_key)
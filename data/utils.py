@@ -1,65 +1,99 @@
+import re
+from typing import Iterable
+
+import pandas as pd
+import pyarrow as pa
+
 _quanjiao2b = ['……', '。。。', '。', '，', '；', '：', '？',
               '！', '“', '”', "‘", "’", "（", "）", '【', '】', '、']
 _banjiao = ['...', '...', '.', ',', ';', ':', '?',
            '!', '"', '"', "'", "'", "(", ")", '[', ']', ',']
 
+_P1 = [',', '.', ';', ':', '?', '!']
+
+# '……' is the only replacement longer than one character that is not a run of single-character ones ('。。。' is
+# three '。'), so it is replaced first and the rest in one pass. str.translate with a mapping looks up every
+# character in Python on non-ASCII text, a regex only calls back for the characters it replaces.
+_WIDE_MAP = {i: j for i, j in zip(_quanjiao2b, _banjiao) if len(i) == 1}
+_WIDE = re.compile('|'.join(map(re.escape, _WIDE_MAP)))
+_SPACE_AFTER = re.compile(r'([,.;:?!])')
+_PUNCT_SPACE = re.compile(r' [,.;:?!]|[,.;:?!] ')
+
+# A space run, the character before it, and an apostrophe followed by one character and a space: ` 's `, ` 't `
+_APOSTROPHE = re.compile(r"([^ ]?)( +)'(?=(\w) )")
+_SPACES = re.compile(r' {2,}')
+
+
+def _strip_punctuation_spaces(line: str) -> str:
+    # Every replace below needs a space next to a punctuation mark, so once there is none the remaining passes
+    # would change nothing. Most lines are done after one pass.
+    puncs = [p for p in _P1 if p in line]
+    for _ in range(5):  # heuristic
+        if not _PUNCT_SPACE.search(line):
+            break
+        for p in puncs:
+            line = line.replace(' ' + p + ' ', p)  # ' , ' -> ','
+            line = line.replace(p + ' ', p)  # ', ' -> ','
+            line = line.replace(' ' + p, p)  # ' ,' -> ','
+    return line
 
-def _repl(data: str, fromjiao: list[str], tojiao: list[str]) -> str:
-    assert len(fromjiao) == len(tojiao)
-    for i, j in zip(fromjiao, tojiao):
-        data = data.replace(i, j)
-    return data
+
+def _join_apostrophes(line: str) -> str:
+    # `word  's ` -> `word's `. Every sample is replaced everywhere, longest first, exactly as the original
+    # character loop did: the order matters when samples overlap.
+    samples = []
+    for match in _APOSTROPHE.finditer(line):
+        if not match.group(3).isalpha():
+            continue
+        i = match.end() - 1
+        if match.group(1):
+            j = match.start()
+        else:
+            # The spaces run from the start of the line, where the original scan stopped at index 0 (or, with a
+            # single leading space, started at -1)
+            j = 0 if i >= 2 else -1
+        samples.append(line[j : i + 3])
+    samples.sort(key=len, reverse=True)
+    for w in samples:
+        line = line.replace(w, w[0] + w[-3:])
+    return line
 
 
 def _process(line: str) -> str:
     '''char Clean, from data preprocessing scripts'''
-    new_line = line.replace('\n', ' ')  # remove \n
-    puncs = [',', '.', ';', ':', '"', "'", "?", '!']
-    p1 = [',', '.', ';', ':', "?", '!']
-    p2 = ["'"]
-    p3 = []
     # policy 1: xxx, xxx
     # policy 2: xxx'xxx
-    # policy 3: 'xxx
     # p1 deal with: wrong space around pronounciation
     # first: clean all space, then add
-    for _ in range(5):  # heuristic
-        for p in p1:
-            new_line = new_line.replace(' '+p+' ', p) # ' , ' -> ','
-            new_line = new_line.replace(p+' ', p) # ', ' -> ',' 
-            new_line = new_line.replace(' '+p, p) # ' ,' -> ','
-
-    for p in p1:
-        new_line = new_line.replace(p, p+' ') # ',' -> ', '
-    # for ...:
+    new_line = _strip_punctuation_spaces(line)
+    new_line = _SPACE_AFTER.sub(r'\1 ', new_line)  # ',' -> ', '
     new_line = new_line.replace('. . . ', '... ')
     # p2 deal with: 's, 't
-    wrong_samples = []
-    for i in range(1, len(new_line)-2):
-        if new_line[i] == "'" and new_line[i+1].isalpha() and new_line[i-1] == ' ' and new_line[i+2] == ' ':
-            j = i-2
-            while j >= 1 and new_line[j] == ' ':
-                j -= 1
-
-            wrong_samples.append(new_line[j:i+3])
-    wrong_samples.sort(key=lambda x: len(x), reverse=True)
-    for w in wrong_samples:
-        new_line = new_line.replace(w, w[0]+w[-3:])
+    if " '" in new_line:
+        new_line = _join_apostrophes(new_line)
     new_line = new_line.replace(" n't", "n't")
-    # remove extra spaces at the end
-    for k in range(len(new_line)-1, -1, -1):
-        if new_line[k] != ' ':
-            new_line = new_line[:k+1]
-            break
-    return new_line
+    # remove extra spaces at the end, a line of nothing but spaces is kept as is
+    return new_line.rstrip(' ') or new_line
 
 
 def clean(data: str) -> str:
-    d = _repl(data, _quanjiao2b, _banjiao)
-    d = _process(d)
-    new_d = d.replace('  ', ' ')
-    while new_d != d:
-        d = new_d
-        new_d = d.replace('  ', ' ')
-    return new_d
+    d = data
+    if not d.isascii():
+        d = _WIDE.sub(lambda m: _WIDE_MAP[m.group()], d.replace('……', '...'))
+    d = _process(d.replace('\n', ' '))
+    return _SPACES.sub(' ', d)
+
+
+def clean_batch(texts: Iterable[str]) -> list[str]:
+    return [clean(text) for text in texts]
+
+
+def clean_column(column: pd.Series | pa.Array | pa.ChunkedArray) -> pd.Series | pa.Array:
+    """Cleans a pandas Series or an Arrow string array and returns a column of the same kind.
 
+    Series values go through astype(str) first, as in Provider._filter. Arrow nulls stay null.
+    """
+    if isinstance(column, pd.Series):
+        return pd.Series(clean_batch(column.astype(str)), index=column.index, name=column.name)
+    values = column.to_pylist()
+    return pa.array([None if text is None else clean(text) for text in values], type=pa.string())
@@ -0,0 +1,54 @@
+"""Bakes the tokenizer and the classifier weights into a local artifact directory for fast startup.
+
+The directory holds `tokenizer/` (saved with save_pretrained, loaded without any hub lookup) and
+`transformer.safetensors`, which `load_classifier` memory-maps instead of unpickling 275MB of weights.
+`model.transformer` picks the directory up automatically, MODEL_ARTIFACTS_DIR points it elsewhere.
+
+Usage: python -m model.artifacts --output model/artifacts
+"""
+
+import argparse
+from pathlib import Path
+
+import torch
+from safetensors.torch import save_file
+from transformers import AutoTokenizer
+
+from model.cache import weights_version
+from model.transformer import ARTIFACTS_DIR, TOKENIZER_NAME, load_safetensors
+
+MODEL_DIR = Path(__file__).parent
+
+
+def bake(weights_path: Path, output: Path):
+    output.mkdir(parents=True, exist_ok=True)
+
+    # Always from the hub: an existing baked copy must not be baked into itself
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    tokenizer.save_pretrained(output / 'tokenizer')
+
+    state_dict = torch.load(weights_path, map_location='cpu')
+    state_dict = {name: tensor.contiguous() for name, tensor in state_dict.items()}
+    weights_output = output / 'transformer.safetensors'
+    # The result cache is keyed by weights version, baked weights keep the version of the original file
+    save_file(state_dict, str(weights_output), metadata={'weights_version': weights_version(weights_path)})
+
+    # Make sure the mapped copy matches what was baked
+    for name, tensor in load_safetensors(weights_output).items():
+        if not torch.equal(tensor, state_dict[name]):
+            raise SystemExit(f'Baked tensor {name} differs from the original weights')
+    return weights_output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bake the tokenizer and weights into a local artifact directory')
+    parser.add_argument('--weights', default=str(MODEL_DIR / 'transformer.pth'))
+    parser.add_argument('--output', default=str(ARTIFACTS_DIR))
+    args = parser.parse_args()
+
+    weights_output = bake(Path(args.weights), Path(args.output))
+    print(f'Baked tokenizer and weights to {args.output} ({weights_output.stat().st_size / 2**20:.1f} MB of weights)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Measures memory per worker process and total throughput of the classifier against the number of workers.
+
+Every worker loads the weights on its own, as a uvicorn worker would, and scores the sample texts for a fixed time.
+Memory is read from /proc/<pid>/smaps_rollup. PSS splits shared pages between the processes mapping them, so with
+memory-mapped safetensors weights the PSS per worker drops as workers are added while it stays flat for `.pth`.
+
+Usage: python -m model.bench_workers --workers 1 2 4 --weights model/artifacts/transformer.safetensors
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import torch
+
+from model.transformer import default_weights_path, encode, load_classifier
+
+
+def memory_mb() -> dict[str, float]:
+    # Rss, Pss, Shared_Clean, Private_Clean, ... of the calling process in MB (Linux only)
+    values = {}
+    for line in Path('/proc/self/smaps_rollup').read_text().splitlines()[1:]:
+        name, value = line.split(':', 1)
+        values[name] = int(value.split()[0]) / 1024
+    return values
+
+
+def worker(weights: str, texts: list[str], batch_size: int, duration: float, threads: int, barrier, results):
+    torch.set_num_threads(threads)
+    model = load_classifier(weights)
+    # Tokenization is done up front, only forward passes are timed
+    batches = [encode(texts[i : i + batch_size]) for i in range(0, len(texts), batch_size)]
+    loaded = memory_mb()
+
+    barrier.wait()
+    scored = 0
+    start = time.perf_counter()
+    with torch.no_grad():
+        while time.perf_counter() - start < duration:
+            for batch in batches:
+                model(batch['input_ids'], batch['attention_mask'])
+                scored += len(batch['input_ids'])
+    elapsed = time.perf_counter() - start
+
+    memory = memory_mb()
+    results.put(
+        {
+            'pid': os.getpid(),
+            'texts': scored,
+            'seconds': elapsed,
+            'rss_after_load_mb': loaded['Rss'],
+            'rss_mb': memory['Rss'],
+            'pss_mb': memory['Pss'],
+            'shared_mb': memory['Shared_Clean'] + memory['Shared_Dirty'],
+            'private_mb': memory['Private_Clean'] + memory['Private_Dirty'],
+        }
+    )
+
+
+def run(weights: str, texts: list[str], workers: int, batch_size: int, duration: float, threads: int) -> dict:
+    # Spawned rather than forked, so workers share nothing but what the OS shares for them
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(weights, texts, batch_size, duration, threads, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    per_worker = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    def mean(key):
+        return sum(result[key] for result in per_worker) / workers
+
+    return {
+        'weights': weights,
+        'workers': workers,
+        'threads_per_worker': threads,
+        'texts_per_second': sum(result['texts'] for result in per_worker) / max(r['seconds'] for r in per_worker),
+        'rss_per_worker_mb': mean('rss_mb'),
+        'pss_per_worker_mb': mean('pss_mb'),
+        'private_per_worker_mb': mean('private_mb'),
+        'total_pss_mb': sum(result['pss_mb'] for result in per_worker),
+        'per_worker': per_worker,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark memory and throughput against the number of workers')
+    parser.add_argument('--weights', nargs='+', default=[str(default_weights_path())])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--data', default='data/merged_sample.csv')
+    parser.add_argument('--texts', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds each configuration is measured')
+    parser.add_argument('--threads', type=int, help='Torch threads per worker, CPU count / workers by default')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.data, lineterminator='\n')['text'].astype(str).tolist()[: args.texts]
+
+    runs = []
+    for weights in args.weights:
+        for workers in args.workers:
+            threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+            result = run(weights, texts, workers, args.batch_size, args.duration, threads)
+            runs.append(result)
+            print(
+                f'{Path(weights).name:<28} workers={workers:<3} threads={threads:<3} '
+                f'{result["texts_per_second"]:8.1f} texts/s  '
+                f'RSS/worker {result["rss_per_worker_mb"]:7.1f} MB  '
+                f'PSS/worker {result["pss_per_worker_mb"]:7.1f} MB  '
+                f'total PSS {result["total_pss_mb"]:7.1f} MB'
+            )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(runs, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark of the scoring pipeline: throughput and latency percentiles per text length and batch size.
+
+Targets:
+    transformer  Model._evaluate_transformer, `batch size` concurrent calls sharing the micro-batcher
+    gradcam      Grad-CAM token attribution (analyze_text_with_gradcam), `batch size` texts per call
+    ainvoke      Model.ainvoke end to end, `batch size` concurrent requests
+
+LLM evaluators talk to a local stub OpenRouter server (model.stub_openrouter) with the given latency, so results do
+not depend on the network or on API quotas. Texts are cut from the sample dataset to the bucket lengths.
+
+Results are printed as a table and written as JSON with --output. With --baseline the run is compared to an
+earlier result file and fails if any p50 latency or throughput regressed by more than --max-regression.
+
+Usage: python -m model.benchmark --output bench.json [--baseline bench_main.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+from model.model import Model
+from model.stub_openrouter import StubOpenRouter
+
+TARGETS = ('transformer', 'gradcam', 'ainvoke')
+# Bucket name -> text length in characters, up to the 10000 characters the API accepts
+LENGTH_BUCKETS = {'short': 200, 'medium': 1000, 'long': 2500, 'xlong': 5000, 'max': 10000}
+
+
+def make_texts(source: list[str], length: int, count: int, seed: int = 0) -> list[str]:
+    # Distinct texts of exactly `length` characters, glued together from shuffled sample texts
+    rng = random.Random(seed + length)
+    texts = []
+    for _ in range(count):
+        parts, size = [], 0
+        while size < length:
+            part = rng.choice(source)
+            parts.append(part)
+            size += len(part) + 1
+        texts.append(' '.join(parts)[:length])
+    return texts
+
+
+def summarize(latencies: list[float], wall: float) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'throughput_per_s': len(latencies) / wall,
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+async def run_concurrent(call, texts: list[str], concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(text):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(text)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(text) for text in texts))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_batched(call, texts: list[str], batch_size: int) -> dict:
+    # Every text in a batch waits for the whole batch
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i : i + batch_size]
+        batch_start = time.perf_counter()
+        call(batch)
+        latencies.extend([time.perf_counter() - batch_start] * len(batch))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def bench(model: Model, target: str, texts: list[str], batch_size: int, models: list) -> dict:
+    if target == 'transformer':
+        return await run_concurrent(model._evaluate_transformer, texts, batch_size)
+    if target == 'gradcam':
+        return run_batched(model.token_attributor.attribute, texts, batch_size)
+    if target == 'ainvoke':
+        return await run_concurrent(lambda text: model.ainvoke(text, models), texts, batch_size)
+    raise ValueError(f'Unknown target: {target}')
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    previous = {(r['target'], r['bucket'], r['batch_size']): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['target'], result['bucket'], result['batch_size']))
+        if before is None:
+            continue
+        name = f'{result["target"]}/{result["bucket"]}/batch={result["batch_size"]}'
+        if result['p50_ms'] > before['p50_ms'] * (1 + max_regression):
+            regressions.append(f'{name}: p50 {before["p50_ms"]:.1f} -> {result["p50_ms"]:.1f} ms')
+        if result['throughput_per_s'] < before['throughput_per_s'] * (1 - max_regression):
+            regressions.append(
+                f'{name}: throughput {before["throughput_per_s"]:.1f} -> {result["throughput_per_s"]:.1f}/s'
+            )
+    return regressions
+
+
+async def main_async(args) -> dict:
+    source = pd.read_csv(args.data, lineterminator='\n')['text'].astype(str).tolist()
+
+    with StubOpenRouter(latency_ms=args.stub_latency_ms, jitter_ms=args.stub_jitter_ms) as stub:
+        # Clients read these when the Model is built. The stub ignores the key, a real one must not leak to it
+        os.environ['OPENROUTER_BASE_URL'] = stub.base_url
+        os.environ['OPENROUTER_API_KEY'] = 'stub'
+        # No result cache, every request is scored from scratch
+        model = Model(device='cpu', max_batch_size=max(args.batch_sizes), weights=args.weights)
+        await model._evaluate_transformer(make_texts(source, 100, 1)[0])  # warm up
+
+        results = []
+        for target in args.targets:
+            for bucket in args.buckets:
+                for batch_size in args.batch_sizes:
+                    texts = make_texts(source, LENGTH_BUCKETS[bucket], args.requests, seed=batch_size)
+                    result = {
+                        'target': target,
+                        'bucket': bucket,
+                        'chars': LENGTH_BUCKETS[bucket],
+                        'batch_size': batch_size,
+                        **await bench(model, target, texts, batch_size, args.models),
+                    }
+                    results.append(result)
+                    print(
+                        f'{target:<12} {bucket:<7} batch={batch_size:<3} '
+                        f'{result["throughput_per_s"]:8.2f}/s  p50 {result["p50_ms"]:8.1f}  '
+                        f'p95 {result["p95_ms"]:8.1f}  p99 {result["p99_ms"]:8.1f} ms'
+                    )
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'weights_version': model.weights_version,
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'cpu_count': os.cpu_count(),
+            'platform': platform.platform(),
+            'stub_latency_ms': args.stub_latency_ms,
+            'stub_jitter_ms': args.stub_jitter_ms,
+            'requests': args.requests,
+            'models': args.models,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scoring pipeline')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--buckets', nargs='+', choices=list(LENGTH_BUCKETS), default=list(LENGTH_BUCKETS))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=64, help='Texts per target, bucket and batch size')
+    parser.add_argument('--models', nargs='+', default=['gpt', 'claude', 'transformer'], help='For ainvoke')
+    parser.add_argument('--weights', help='Classifier artifact, see model.export and model.artifacts')
+    parser.add_argument('--data', default='data/merged_sample.csv')
+    parser.add_argument('--stub-latency-ms', type=float, default=800.0)
+    parser.add_argument('--stub-jitter-ms', type=float, default=200.0)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Earlier --output file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.15)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        regressions = compare(report['results'], baseline, args.max_regression)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            raise SystemExit(f'{len(regressions)} regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
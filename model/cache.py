@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+def weights_version(weights_path: Path) -> str:
+    # The DVC pointer already holds the md5 of the weights, so there is no need to hash 275MB at startup
+    if weights_path.suffix == '.safetensors':
+        # Baked artifacts carry the md5 of the weights they were converted from in the header metadata
+        with open(weights_path, 'rb') as f:
+            (header_size,) = struct.unpack('<Q', f.read(8))
+            version = json.loads(f.read(header_size)).get('__metadata__', {}).get('weights_version')
+        if version:
+            return version
+    dvc_path = weights_path.with_name(weights_path.name + '.dvc')
+    if dvc_path.exists():
+        for line in dvc_path.read_text().splitlines():
+            if line.strip().startswith('- md5:'):
+                return line.split(':', 1)[1].strip()
+    stat = weights_path.stat()
+    return f'{stat.st_size}-{int(stat.st_mtime)}'
+
+
+def normalize_text(text: str) -> str:
+    # XLM-R collapses whitespace itself, so texts differing only in whitespace score the same
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def json_size(value: Any) -> int:
+    # Size of a cached result by its JSON serialization. The Python objects take a few times more, token dicts most
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+def cache_key(text: str, *parts: Any, normalize: bool = True) -> str:
+    # Entries holding character offsets or tokens of the text (transformer windows, full results) must be keyed on
+    # the exact text: a whitespace variant would get offsets pointing at the wrong characters
+    payload = json.dumps([normalize_text(text) if normalize else text, *parts], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CacheTier(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any):
+        pass
+
+
+class LRUCache(CacheTier):
+    # Holds at most `max_size` entries and, if `max_bytes` is set, entries whose `sizeof` adds up to at most that
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: Optional[float] = 24 * 3600,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._data: OrderedDict[str, tuple[float, Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value, size = item
+            if expires_at < time.time():
+                del self._data[key]
+                self.bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl else float('inf')
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._data[key] = (expires_at, value, size)
+            self.bytes += size
+            while len(self._data) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(CacheTier):
+    def __init__(self, path: str, ttl: Optional[float] = 7 * 24 * 3600):
+        self.ttl = ttl
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+            self._conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM cache WHERE key = ? AND expires_at >= ?', (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl else float('inf')
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+
+
+class ResultCache:
+    """Two-tier cache: in-process LRU in front of an optional persistent tier.
+
+    The persistent tier does blocking I/O, so it is called from a worker thread and `get`/`set` are coroutines.
+    """
+
+    def __init__(self, memory: Optional[LRUCache] = None, disk: Optional[CacheTier] = None):
+        self.memory = memory or LRUCache()
+        self.disk = disk
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits['memory'] += 1
+            return value
+        if self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.hits['disk'] += 1
+                self.memory.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    def stats(self) -> dict:
+        return {
+            'hits': dict(self.hits),
+            'misses': self.misses,
+            'memory_size': len(self.memory),
+            'memory_bytes': self.memory.bytes,
+        }
@@ -0,0 +1,51 @@
+"""Checks that dynamic padding reproduces the scores of the original fixed-length forward pass.
+
+Usage: python -m model.check_padding --data data/merged_sample.csv
+"""
+
+import argparse
+from pathlib import Path
+
+import pandas as pd
+import torch
+import torch.nn.functional as F
+
+from model.transformer import TransformerClassifier, encode, load_classifier
+
+
+def legacy_forward(model: TransformerClassifier, input_ids, attention_mask):
+    # Forward pass as it was before masked pooling: plain mean over all MAX_LENGTH positions
+    x = model.pos_encoder(model.embedding(input_ids))
+    x = model.transformer_encoder(x, src_key_padding_mask=attention_mask == 0)
+    return model.classifier(x.mean(dim=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fixed and dynamic padding scores')
+    parser.add_argument('--data', default='data/merged_sample.csv')
+    parser.add_argument('--weights', default=str(Path(__file__).with_name('transformer.pth')))
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model = load_classifier(args.weights)
+
+    texts = pd.read_csv(args.data, lineterminator='\n')['text'].astype(str).tolist()
+
+    max_diff = 0.0
+    for i in range(0, len(texts), args.batch_size):
+        batch = texts[i : i + args.batch_size]
+        fixed = encode(batch, padding='max_length')
+        dynamic = encode(batch)
+        with torch.no_grad():
+            old = F.softmax(legacy_forward(model, fixed['input_ids'], fixed['attention_mask']), dim=1)[:, 1]
+            new = F.softmax(model(dynamic['input_ids'], dynamic['attention_mask']), dim=1)[:, 1]
+        max_diff = max(max_diff, (old - new).abs().max().item())
+
+    print(f'Texts: {len(texts)}, max |old - new| human probability: {max_diff:.2e}')
+    if max_diff > args.tolerance:
+        raise SystemExit(f'Scores differ by more than {args.tolerance}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Exports the classifier for CPU inference and checks it against the fp32 weights.
+
+Formats:
+    torchscript  TorchScript fp32                           -> model/transformer.ts.pt
+    int8         TorchScript with int8 dynamic quantization -> model/transformer.int8.pt
+    onnx         ONNX fp32                                  -> model/transformer.onnx
+    onnx-int8    ONNX with int8 dynamic quantization        -> model/transformer.int8.onnx
+
+The exported file is loaded with `load_classifier` and scored on the sample dataset next to the original model.
+The export fails if accuracy drops by more than --max-accuracy-drop.
+
+Usage: python -m model.export --format int8 --data data/merged_sample.csv
+Serve it with TRANSFORMER_WEIGHTS=model/transformer.int8.pt
+"""
+
+import argparse
+import importlib.util
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model.transformer import TransformerClassifier, encode, load_classifier
+
+MODEL_DIR = Path(__file__).parent
+OUTPUTS = {
+    'torchscript': MODEL_DIR / 'transformer.ts.pt',
+    'int8': MODEL_DIR / 'transformer.int8.pt',
+    'onnx': MODEL_DIR / 'transformer.onnx',
+    'onnx-int8': MODEL_DIR / 'transformer.int8.onnx',
+}
+
+
+def export_torchscript(model: TransformerClassifier, output: Path, quantize: bool = False):
+    if quantize:
+        # Weights of the feed-forward and classifier layers are stored as int8 and activations are quantized on
+        # the fly, attention projections stay fp32
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    torch.jit.save(torch.jit.script(model), str(output))
+
+
+def export_onnx(model: TransformerClassifier, output: Path, quantize: bool = False):
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # The fp32 graph is only an intermediate here, it must not replace an existing model/transformer.onnx
+        with tempfile.TemporaryDirectory() as tmp:
+            fp32_output = Path(tmp) / 'transformer.onnx'
+            export_onnx(model, fp32_output)
+            quantize_dynamic(str(fp32_output), str(output), weight_type=QuantType.QInt8)
+        return
+
+    sample = encode(['Sample text for export', 'A second, slightly longer sample text for export'])
+    torch.onnx.export(
+        model,
+        (sample['input_ids'], sample['attention_mask']),
+        str(output),
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'},
+        },
+        opset_version=17,
+    )
+
+
+def score(model, texts: list[str], batch_size: int) -> tuple[torch.Tensor, float]:
+    # Human probabilities and the seconds spent in forward passes
+    probs = []
+    elapsed = 0.0
+    for i in range(0, len(texts), batch_size):
+        encoding = encode(texts[i : i + batch_size])
+        start = time.perf_counter()
+        with torch.no_grad():
+            logits = model(encoding['input_ids'], encoding['attention_mask'])
+        elapsed += time.perf_counter() - start
+        probs.append(F.softmax(logits, dim=1)[:, 1])
+    return torch.cat(probs), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the classifier and check parity with the fp32 weights')
+    parser.add_argument('--format', choices=list(OUTPUTS), default='int8')
+    parser.add_argument('--weights', default=str(MODEL_DIR / 'transformer.pth'))
+    parser.add_argument('--output', help='Defaults to model/transformer.<format> next to the weights')
+    parser.add_argument('--data', default='data/merged_sample.csv')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01)
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else OUTPUTS[args.format]
+    if args.format.startswith('onnx'):
+        # torch.onnx.export writes with onnx, the parity check runs the export with onnxruntime
+        missing = [name for name in ('onnx', 'onnxruntime') if not importlib.util.find_spec(name)]
+        if missing:
+            parser.error(f'--format {args.format} needs {" and ".join(missing)}: pip install {" ".join(missing)}')
+
+    model = load_classifier(args.weights)
+
+    quantize = args.format.endswith('int8')
+    if args.format.startswith('onnx'):
+        export_onnx(model, output, quantize)
+    else:
+        export_torchscript(model, output, quantize)
+    print(f'Exported {args.format} to {output} ({output.stat().st_size / 2**20:.1f} MB)')
+
+    df = pd.read_csv(args.data, lineterminator='\n')
+    texts = df['text'].astype(str).tolist()
+    labels = torch.tensor(df['is_human'].astype(int).tolist())
+
+    reference, reference_time = score(model, texts, args.batch_size)
+    exported, exported_time = score(load_classifier(output), texts, args.batch_size)
+
+    reference_accuracy = ((reference > 0.5).long() == labels).float().mean().item()
+    exported_accuracy = ((exported > 0.5).long() == labels).float().mean().item()
+    agreement = ((reference > 0.5) == (exported > 0.5)).float().mean().item()
+    print(f'Texts: {len(texts)}')
+    print(f'Accuracy: fp32 {reference_accuracy:.4f}, {args.format} {exported_accuracy:.4f}')
+    max_diff = (reference - exported).abs().max()
+    print(f'Prediction agreement: {agreement:.4f}, max |fp32 - {args.format}|: {max_diff:.2e}')
+    print(f'Forward time: fp32 {reference_time:.2f}s, {args.format} {exported_time:.2f}s')
+
+    if reference_accuracy - exported_accuracy > args.max_accuracy_drop:
+        raise SystemExit(f'Accuracy dropped by more than {args.max_accuracy_drop}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import inspect
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import structlog
+from prometheus_client import Counter, Histogram
+
+logger = structlog.get_logger()
+
+# From 5ms to a minute: the transformer stages take milliseconds, LLM calls take seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+NODE_SECONDS = Histogram(
+    'pipeline_node_seconds', 'Time spent in each node of the scoring graph', ['node'], buckets=LATENCY_BUCKETS
+)
+EVALUATOR_SECONDS = Histogram(
+    'evaluator_seconds', 'Time per evaluator call by outcome', ['evaluator', 'outcome'], buckets=LATENCY_BUCKETS
+)
+TRANSFORMER_STAGE_SECONDS = Histogram(
+    'transformer_stage_seconds',
+    'Tokenization and forward pass time per transformer batch',
+    ['stage'],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_STAGE_SECONDS = Histogram(
+    'llm_stage_seconds',
+    'Time waiting for the LLM and parsing its output per evaluator call',
+    ['evaluator', 'stage'],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter('llm_tokens', 'Tokens used by LLM calls', ['evaluator', 'kind'])
+LLM_RETRIES = Counter('llm_retries', 'LLM request attempts beyond the first', ['evaluator'])
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def _record_node(name: str, seconds: float):
+    NODE_SECONDS.labels(node=name).observe(seconds)
+    logger.info('pipeline_node', node=name, seconds=round(seconds, 4))
+
+
+def timed_node(name: str, node):
+    # Wraps a graph node so every run is logged and observed under `name`, sync and async nodes alike
+    if inspect.iscoroutinefunction(node):
+
+        @wraps(node)
+        async def async_wrapper(state):
+            start = time.perf_counter()
+            try:
+                return await node(state)
+            finally:
+                _record_node(name, time.perf_counter() - start)
+
+        return async_wrapper
+
+    @wraps(node)
+    def wrapper(state):
+        start = time.perf_counter()
+        try:
+            return node(state)
+        finally:
+            _record_node(name, time.perf_counter() - start)
+
+    return wrapper
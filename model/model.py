@@ -1,7 +1,13 @@
 import asyncio
+import copy
+import threading
+import time
+from functools import cached_property
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
+import openai
+import structlog
 import torch
 import torch.nn.functional as F
 from dotenv import load_dotenv
@@ -11,13 +17,27 @@ from langgraph.graph import END, START, StateGraph
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 
-from model.transformer import MAX_LENGTH, TransformerClassifier, tokenizer
+from model.batching import BatchScheduler
+from model.cache import ResultCache, cache_key, weights_version
+from model.metrics import EVALUATOR_SECONDS, TRANSFORMER_STAGE_SECONDS, observe, timed_node
+from model.transformer import (
+    MAX_LENGTH,
+    TransformerClassifier,
+    default_weights_path,
+    encode,
+    encode_windows,
+    get_tokenizer,
+    load_classifier,
+)
 from model.utils.JsonExtractor import JsonExtractor
+from model.utils.LLMCallStats import LLMCallStats
 from model.utils.OpenRouter import OpenRouter
-from model.utils.Tokenizer import analyze_text_with_gradcam
+from model.utils.Tokenizer import TokenAttributor
 
 load_dotenv()
 
+logger = structlog.get_logger()
+
 
 class EvaluatorSchema(BaseModel):
     score: int = Field(description='Given the text, return score from 0 to 100 indicating how human-like the text is')
@@ -122,7 +142,15 @@ class State(TypedDict):
     tokens: list[dict[str, float]]
     examples: str
     models: list
+    scored_models: list
+    window_aggregation: str
+    windows: list[dict]
+
 
+# The OpenAI client retries on its own where callbacks cannot see it, so retries happen at the chain level instead
+# and every attempt shows up in LLMCallStats. Same attempts and error types as the client's defaults
+LLM_MAX_ATTEMPTS = 3
+LLM_RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
 
 # Base weights for each model when used in the ensemble
 EVALUATOR_WEIGHTS = {
@@ -131,24 +159,76 @@ EVALUATOR_WEIGHTS = {
     'transformer': 0.84,
 }
 
+# How per-window human probabilities of a long text are combined into one transformer score
+WINDOW_AGGREGATIONS = ('mean', 'weighted', 'max_ai')
+
+
+def aggregate_windows(windows: list[dict], aggregation: str = 'weighted') -> float:
+    scores = [window['score'] for window in windows]
+    if aggregation == 'mean':
+        return sum(scores) / len(scores)
+    if aggregation == 'weighted':
+        # Longer windows (the last one is usually short) count proportionally more
+        total_tokens = sum(window['tokens'] for window in windows)
+        return sum(window['score'] * window['tokens'] for window in windows) / total_tokens
+    if aggregation == 'max_ai':
+        # The most AI-like section decides
+        return min(scores)
+    raise ValueError(f'Unknown window aggregation: {aggregation}. Supported: {", ".join(WINDOW_AGGREGATIONS)}')
+
 
 class Model:
-    def __init__(self, device='cpu'):
+    def __init__(
+        self,
+        device='cpu',
+        max_batch_size=32,
+        max_wait_ms=5.0,
+        evaluator_timeout=20.0,
+        latency_budget=25.0,
+        cache: Optional[ResultCache] = None,
+        weights: Optional[str] = None,
+    ):
         self.device = device
+        # Seconds a single LLM evaluator may take, and the overall budget for the evaluators node
+        self.evaluator_timeout = evaluator_timeout
+        self.latency_budget = latency_budget
+
+        # `weights` may point to an artifact written by model.export, the fp32 weights are used otherwise
+        self.fp32_weights_path = default_weights_path()
+        self.weights_path = Path(weights) if weights else self.fp32_weights_path
+        self.cache = cache
+        self.weights_version = weights_version(self.weights_path)
+
+        self.transformer = load_classifier(self.weights_path, self.device)
+        # Built here, in the loader thread, so the first request does not load it (or download it) on the event loop
+        get_tokenizer()
+
+        # Grad-CAM hooks into the encoder, so forward passes on the shared weights must not overlap
+        self.transformer_lock = threading.Lock()
+
+        # Concurrent requests are grouped into a single forward pass
+        self.transformer_batcher = BatchScheduler(
+            self._predict_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        )
 
-        self.transformer = TransformerClassifier(vocab_size=tokenizer.vocab_size)
-        self.transformer.load_state_dict(
-            torch.load(Path(__file__).with_name('transformer.pth'), map_location=self.device)
+        self.attribution_batcher = BatchScheduler(
+            self._attribute_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
         )
-        self.transformer = self.transformer.to(self.device)
-        self.transformer.eval()  # Set to evaluation mode
 
         self.evaluator_llms = {
-            'gpt': OpenRouter(model_name='openai/o4-mini', temperature=0),
-            'claude': OpenRouter(model_name='anthropic/claude-3.7-sonnet', temperature=0),
+            'gpt': OpenRouter(model_name='openai/o4-mini', temperature=0, max_retries=0),
+            'claude': OpenRouter(model_name='anthropic/claude-3.7-sonnet', temperature=0, max_retries=0),
         }
         self.evaluator_chains = {
-            name: (evaluator_prompt | evaluator_llm | StrOutputParser() | JsonExtractor() | evaluator_parser)
+            name: (
+                evaluator_prompt
+                | evaluator_llm.with_retry(
+                    retry_if_exception_type=LLM_RETRYABLE_ERRORS, stop_after_attempt=LLM_MAX_ATTEMPTS
+                )
+                | StrOutputParser()
+                | JsonExtractor()
+                | evaluator_parser
+            )
             for name, evaluator_llm in self.evaluator_llms.items()
         }
 
@@ -158,11 +238,12 @@ class Model:
 
         graph_builder = StateGraph(State)
 
-        graph_builder.add_node('evaluators', self._evaluators)
-        graph_builder.add_node('aggregator', self._aggregator)
-        graph_builder.add_node('explanation_node', self._explanation)
-        graph_builder.add_node('token_analysis', self._token_analysis)
-        graph_builder.add_node('suggestions', self._suggestions)
+        # Every node is timed, see model.metrics
+        graph_builder.add_node('evaluators', timed_node('evaluators', self._evaluators))
+        graph_builder.add_node('aggregator', timed_node('aggregator', self._aggregator))
+        graph_builder.add_node('explanation_node', timed_node('explanation_node', self._explanation))
+        graph_builder.add_node('token_analysis', timed_node('token_analysis', self._token_analysis))
+        graph_builder.add_node('suggestions', timed_node('suggestions', self._suggestions))
 
         graph_builder.add_edge(START, 'evaluators')
         graph_builder.add_edge('evaluators', 'aggregator')
@@ -176,56 +257,195 @@ class Model:
     def _clamp(self, n, min_value, max_value):
         return max(min_value, min(n, max_value))
 
-    async def _evaluate_transformer(self, text: str) -> float:
-        # Tokenize and prepare input
-        encoding = tokenizer(
-            text,
-            add_special_tokens=True,
-            max_length=MAX_LENGTH,
-            padding='max_length',
-            truncation=True,
-            return_tensors='pt',
-        )
+    def _predict_batch(self, texts: list[str]) -> list[Optional[float]]:
+        # Texts longer than MAX_LENGTH tokens are scored by windows instead, they get None here
+        with observe(TRANSFORMER_STAGE_SECONDS, stage='tokenize'):
+            lengths = get_tokenizer()(texts, add_special_tokens=True, return_length=True)['length']
+            fitting = [text for text, length in zip(texts, lengths) if length <= MAX_LENGTH]
+            if not fitting:
+                return [None] * len(texts)
+            # Tokenize and prepare input, padded only to the longest text in the batch
+            encoding = encode(fitting)
         input_ids = encoding['input_ids'].to(self.device)
         attention_mask = encoding['attention_mask'].to(self.device)
 
         # Get model prediction
-        with torch.no_grad():
+        with self.transformer_lock, torch.no_grad(), observe(TRANSFORMER_STAGE_SECONDS, stage='forward'):
             outputs = self.transformer(input_ids, attention_mask)
             probs = F.softmax(outputs, dim=1)
-            human_prob = probs[0][1].item()  # Probability of human class
+            human_probs = iter(probs[:, 1].tolist())  # Probability of human class
+
+        return [next(human_probs) if length <= MAX_LENGTH else None for length in lengths]
 
-        return human_prob
+    @cached_property
+    def token_attributor(self) -> TokenAttributor:
+        # Grad-CAM needs the eager fp32 module. Exported artifacts cannot be hooked, so the fp32 weights are loaded
+        # separately on first use
+        if isinstance(self.transformer, TransformerClassifier):
+            return TokenAttributor(self.transformer, self.device, lock=self.transformer_lock)
+        return TokenAttributor(load_classifier(self.fp32_weights_path, self.device), self.device)
+
+    def _attribute_batch(self, texts: list[str]) -> list[list[dict[str, float]]]:
+        return self.token_attributor.attribute(texts)
+
+    def _predict_windows(self, text: str) -> list[dict]:
+        with observe(TRANSFORMER_STAGE_SECONDS, stage='tokenize'):
+            encoding = encode_windows(text)
+        input_ids = encoding['input_ids'].to(self.device)
+        attention_mask = encoding['attention_mask'].to(self.device)
 
-    async def _evaluate_chain(self, chain, text: str) -> float:
+        # All windows go through the encoder as a single batch
+        with self.transformer_lock, torch.no_grad(), observe(TRANSFORMER_STAGE_SECONDS, stage='forward'):
+            outputs = self.transformer(input_ids, attention_mask)
+            human_probs = F.softmax(outputs, dim=1)[:, 1].tolist()
+
+        windows = []
+        for offsets, special, score in zip(encoding['offset_mapping'], encoding['special_tokens_mask'], human_probs):
+            spans = offsets[special == 0]
+            windows.append(
+                {
+                    'start': int(spans[0][0]),
+                    'end': int(spans[-1][1]),
+                    'tokens': len(spans),
+                    'score': score,
+                }
+            )
+        return windows
+
+    async def _cache_get(self, key: str):
+        return await self.cache.get(key) if self.cache is not None else None
+
+    async def _cache_set(self, key: str, value):
+        if self.cache is not None:
+            await self.cache.set(key, value)
+
+    async def _evaluate_transformer(self, text: str, aggregation: str = 'weighted') -> tuple[float, list[dict]]:
+        key = cache_key(text, 'transformer', self.weights_version, aggregation, normalize=False)
+        cached = await self._cache_get(key)
+        if cached is not None:
+            return cached['score'], cached['windows']
+
+        # Texts that fit into MAX_LENGTH tokens share forward passes with concurrent requests. The batcher measures
+        # them in its worker thread and returns None for longer ones, which are scored window by window
+        score, windows = await self.transformer_batcher.submit(text), []
+        if score is None:
+            windows = await asyncio.to_thread(self._predict_windows, text)
+            score = aggregate_windows(windows, aggregation)
+
+        await self._cache_set(key, {'score': score, 'windows': windows})
+        return score, windows
+
+    async def _evaluate_chain(
+        self,
+        chain,
+        text: str,
+        timeout: Optional[float] = None,
+        key: Optional[str] = None,
+        evaluator: str = 'llm',
+    ) -> float:
+        cached = await self._cache_get(key) if key else None
+        if cached is not None:
+            EVALUATOR_SECONDS.labels(evaluator=evaluator, outcome='cached').observe(0)
+            return cached
+
+        stats = LLMCallStats()
+        outcome = 'error'
+        start = time.perf_counter()
         try:
-            result = await chain.ainvoke(text)
+            result = await asyncio.wait_for(chain.ainvoke(text, config={'callbacks': [stats]}), timeout)
             score = result.score
             score = self._clamp(score, 0, 100)
+            outcome = 'ok'
+            # Only real answers are cached, the neutral fallback below is not
+            if key:
+                await self._cache_set(key, score / 100)
             return score / 100
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        except asyncio.CancelledError:
+            # Cancelled by the evaluators node when the latency budget ran out
+            outcome = 'cancelled'
+            raise
         except Exception as e:
-            print(f'Error evaluating chain: {e}')
+            logger.warning('evaluator_error', evaluator=evaluator, error=str(e))
             return 0.5
+        finally:
+            seconds = time.perf_counter() - start
+            EVALUATOR_SECONDS.labels(evaluator=evaluator, outcome=outcome).observe(seconds)
+            stats.record(evaluator, seconds)
+            logger.info(
+                'evaluator',
+                evaluator=evaluator,
+                outcome=outcome,
+                seconds=round(seconds, 4),
+                llm_seconds=round(stats.llm_seconds, 4),
+                prompt_tokens=stats.prompt_tokens,
+                completion_tokens=stats.completion_tokens,
+                retries=stats.retries,
+            )
+
+    async def _timed_transformer(self, state: State) -> tuple[float, list[dict]]:
+        # Recorded with the same outcomes as the LLM evaluators in _evaluate_chain
+        outcome = 'error'
+        start = time.perf_counter()
+        try:
+            result = await self._evaluate_transformer(state['text'], state.get('window_aggregation') or 'weighted')
+            outcome = 'ok'
+            return result
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            EVALUATOR_SECONDS.labels(evaluator='transformer', outcome=outcome).observe(time.perf_counter() - start)
 
     async def _evaluators(self, state: State) -> State:
-        # Get scores from all evaluators
-        llm_scores = []
-        for model in state['models']:
-            if model == 'transformer':
-                continue
-            res = await self._evaluate_chain(self.evaluator_chains[model], state['text'])
-            llm_scores.append(res)
-
-        transformer_score = await self._evaluate_transformer(state['text'])
-
-        # Combine all scores
-        scores = llm_scores + [transformer_score]
-
-        # Verify all scores are valid
-        if any(score is None for score in scores):
-            raise ValueError('One or more evaluators returned None score')
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.latency_budget
+
+        # Start all LLM evaluators at once, the transformer runs while they are in flight
+        llm_tasks = {
+            model: asyncio.create_task(
+                self._evaluate_chain(
+                    self.evaluator_chains[model],
+                    state['text'],
+                    self.evaluator_timeout,
+                    key=cache_key(state['text'], 'evaluator', model),
+                    evaluator=model,
+                )
+            )
+            for model in state['models']
+            if model != 'transformer'
+        }
 
-        return {'intermediate_scores': scores}
+        try:
+            transformer_score, windows = await self._timed_transformer(state)
+            scores = {'transformer': transformer_score}
+
+            if llm_tasks:
+                done, _ = await asyncio.wait(llm_tasks.values(), timeout=max(deadline - loop.time(), 0))
+
+                # Evaluators that timed out or missed the deadline are left out of the aggregate
+                for model, task in llm_tasks.items():
+                    if task in done and task.exception() is None:
+                        scores[model] = task.result()
+                    else:
+                        logger.warning('evaluator_skipped', evaluator=model, reason='latency_budget')
+        finally:
+            # Stops the evaluators still running past the deadline, and all of them if the transformer failed or
+            # this node was cancelled
+            for task in llm_tasks.values():
+                task.cancel()
+
+        scored_models = [model for model in state['models'] if model in scores]
+        return {
+            'intermediate_scores': [scores[model] for model in scored_models],
+            'scored_models': scored_models,
+            'windows': windows,
+        }
 
     def _get_normalized_weights(self, models: list) -> list[float]:
         weights = [EVALUATOR_WEIGHTS[model] for model in models]
@@ -233,7 +453,7 @@ class Model:
         return [w / total_weight for w in weights]
 
     def _aggregator(self, state: State) -> State:
-        normalized_weights = self._get_normalized_weights(state['models'])
+        normalized_weights = self._get_normalized_weights(state.get('scored_models') or state['models'])
         weighted_sum = sum(score * weight for score, weight in zip(state['intermediate_scores'], normalized_weights))
         return {'score': weighted_sum}
 
@@ -253,7 +473,7 @@ class Model:
 
     async def _token_analysis(self, state: State) -> State:
         return {'tokens': []}
-        tokens = analyze_text_with_gradcam(state['text'])
+        tokens = await self.attribution_batcher.submit(state['text'])
         return {'tokens': tokens}
 
     async def _suggestions(self, state: State) -> State:
@@ -273,5 +493,18 @@ class Model:
         except Exception:
             return {'examples': text_resp}
 
-    async def ainvoke(self, text: str, models: list) -> Dict:
-        return await self.model.ainvoke({'text': text, 'models': models})
+    async def ainvoke(self, text: str, models: list, window_aggregation: str = 'weighted') -> Dict:
+        if window_aggregation not in WINDOW_AGGREGATIONS:
+            raise ValueError(f'Unknown window aggregation: {window_aggregation}')
+
+        key = cache_key(text, 'result', sorted(set(models)), self.weights_version, window_aggregation, normalize=False)
+        cached = await self._cache_get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        result = await self.model.ainvoke({'text': text, 'models': models, 'window_aggregation': window_aggregation})
+
+        # Results degraded by the latency budget are not cached, so the next request gets a full answer
+        if set(result['scored_models']) == set(models):
+            await self._cache_set(key, copy.deepcopy(dict(result)))
+        return result
@@ -0,0 +1,121 @@
+"""Local stand-in for the OpenRouter chat completions API with configurable latency.
+
+Every completion answers with a JSON object that the evaluator, explanation and suggestions parsers all accept,
+after sleeping for `latency_ms` plus up to `jitter_ms`. Point the clients at it with
+OPENROUTER_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Usage: python -m model.stub_openrouter --port 8081 --latency-ms 800 --jitter-ms 400
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_CONTENT = json.dumps(
+    {
+        'score': 50,
+        'explanation': 'Ответ тестового сервера.',
+        'examples': 'Ответ тестового сервера.',
+    },
+    ensure_ascii=False,
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'StubOpenRouter'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.sample_latency())
+        prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in body.get('messages', []))
+        completion_tokens = len(STUB_CONTENT.split())
+        payload = json.dumps(
+            {
+                'id': f'stub-{time.time_ns()}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'stub'),
+                'choices': [
+                    {
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': STUB_CONTENT},
+                        'finish_reason': 'stop',
+                    }
+                ],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            }
+        ).encode()
+        self.server.requests += 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOpenRouter(ThreadingHTTPServer):
+    """Serves the stub API from a background thread. `with StubOpenRouter(...) as stub:` starts and stops it."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def sample_latency(self) -> float:
+        return (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stub of the OpenRouter API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=800.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubOpenRouter(args.host, args.port, args.latency_ms, args.jitter_ms)
+    print(f'Stub OpenRouter listening on {server.base_url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Tokenizes the merged dataset once into memory-mapped int32 token shards, and the Dataset that reads them.
+
+Every shard is a set of .npy files: `tokens` (all token IDs of the shard back to back, int32), `offsets` (rows + 1
+positions into `tokens`), `labels` (is_human, int8), `lang` (index into the `langs` of meta.json, uint8) and, when
+the CSV has a cluster_id column (data/near_dedup.py), `groups` (int64). meta.json is written last and lists the
+shards, so a directory without it is an unfinished build.
+
+Texts are truncated to MAX_LENGTH tokens with special tokens added, as the training notebook did. Padding is left to
+the collate function, which pads each batch to its longest row.
+
+Usage: python -m model.token_shards --data data/merged.csv --output data/tokens --workers 8
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset
+
+from model.transformer import MAX_LENGTH, PAD_TO_MULTIPLE_OF, TOKENIZER_NAME, get_tokenizer
+
+ARRAYS = ('tokens', 'offsets', 'labels', 'lang')
+
+
+def _init_worker():
+    # Each worker is one process already, the tokenizer's own thread pool would only oversubscribe the cores
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+
+def _tokenize(texts: list[str], max_length: int) -> tuple[np.ndarray, np.ndarray]:
+    input_ids = get_tokenizer()(texts, add_special_tokens=True, truncation=True, max_length=max_length)['input_ids']
+    lengths = np.fromiter(map(len, input_ids), dtype=np.int64, count=len(input_ids))
+    tokens = np.fromiter(itertools.chain.from_iterable(input_ids), dtype=np.int32, count=int(lengths.sum()))
+    return tokens, lengths
+
+
+class _ShardWriter:
+    def __init__(self, output: Path, shard_rows: int, with_groups: bool):
+        self.output = output
+        self.shard_rows = shard_rows
+        self.with_groups = with_groups
+        self.shards = []
+        self._reset()
+
+    def _reset(self):
+        self.tokens, self.lengths, self.labels, self.lang, self.groups = [], [], [], [], []
+        self.rows = 0
+
+    def add(self, tokens: np.ndarray, lengths: np.ndarray, chunk: pd.DataFrame, lang_codes: np.ndarray):
+        self.tokens.append(tokens)
+        self.lengths.append(lengths)
+        self.labels.append(chunk['is_human'].to_numpy(dtype=np.int8))
+        self.lang.append(lang_codes)
+        if self.with_groups:
+            self.groups.append(chunk['cluster_id'].to_numpy(dtype=np.int64))
+        self.rows += len(chunk)
+        if self.rows >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        name = f'shard-{len(self.shards):05d}'
+        lengths = np.concatenate(self.lengths)
+        arrays = {
+            'tokens': np.concatenate(self.tokens),
+            'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            'labels': np.concatenate(self.labels),
+            'lang': np.concatenate(self.lang),
+        }
+        if self.with_groups:
+            arrays['groups'] = np.concatenate(self.groups)
+        for array_name, array in arrays.items():
+            np.save(self.output / f'{name}.{array_name}.npy', array)
+        self.shards.append({'name': name, 'rows': self.rows, 'tokens': len(arrays['tokens'])})
+        self._reset()
+
+
+def build_shards(
+    csv_path: str,
+    output: Path,
+    workers: int,
+    batch_size: int = 1000,
+    shard_rows: int = 100_000,
+    max_length: int = MAX_LENGTH,
+) -> dict:
+    """Tokenizes `csv_path` in batches on a process pool and writes the shards to `output`. Returns the meta."""
+    output.mkdir(parents=True, exist_ok=True)
+    (output / 'meta.json').unlink(missing_ok=True)
+    with_groups = 'cluster_id' in pd.read_csv(csv_path, lineterminator='\n', nrows=0).columns
+    writer = _ShardWriter(output, shard_rows, with_groups)
+    langs: dict[str, int] = {}
+
+    def collect(chunk, future):
+        tokens, lengths = future.result()
+        lang_codes = np.array([langs.setdefault(lang, len(langs)) for lang in chunk['lang'].astype(str)], np.uint8)
+        writer.add(tokens, lengths, chunk, lang_codes)
+
+    # Batches go out in order and come back in order, at most two per worker in flight
+    pending = []
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('fork'), initializer=_init_worker) as pool:
+        # Texts such as 'NA' or 'null' are texts, not missing values
+        for chunk in pd.read_csv(csv_path, lineterminator='\n', chunksize=batch_size, keep_default_na=False):
+            texts = chunk['text'].astype(str).tolist()
+            pending.append((chunk, pool.submit(_tokenize, texts, max_length)))
+            while len(pending) >= 2 * workers or (pending and pending[0][1].done()):
+                collect(*pending.pop(0))
+        for chunk, future in pending:
+            collect(chunk, future)
+    writer.flush()
+
+    tokenizer = get_tokenizer()
+    meta = {
+        'source': str(csv_path),
+        'tokenizer': TOKENIZER_NAME,
+        'vocab_size': len(tokenizer),
+        'pad_token_id': tokenizer.pad_token_id,
+        'max_length': max_length,
+        'langs': list(langs),
+        'groups': with_groups,
+        'rows': sum(shard['rows'] for shard in writer.shards),
+        'tokens': sum(shard['tokens'] for shard in writer.shards),
+        'shards': writer.shards,
+    }
+    (output / 'meta.json').write_text(json.dumps(meta, indent=2))
+    return meta
+
+
+class TokenShardDataset(Dataset):
+    """Rows of the token shards in `directory`, as {'input_ids': int32 tensor, 'label': int}.
+
+    The shards are memory-mapped copy-on-write, so `input_ids` is a view of the mapped file rather than a copy and
+    the pages are shared between DataLoader workers. Lengths, labels, langs and groups of all rows are small enough
+    to keep in memory, samplers and splits use them directly.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.meta = json.loads((self.directory / 'meta.json').read_text())
+        self.pad_token_id = self.meta['pad_token_id']
+        self._open()
+
+    def _open(self):
+        names = ARRAYS + (('groups',) if self.meta['groups'] else ())
+        self._shards = [
+            {name: np.load(self.directory / f'{shard["name"]}.{name}.npy', mmap_mode='c') for name in names}
+            for shard in self.meta['shards']
+        ]
+        self._starts = np.cumsum([0] + [shard['rows'] for shard in self.meta['shards']])
+        self.lengths = np.concatenate([np.diff(shard['offsets']) for shard in self._shards] or [np.empty(0, np.int64)])
+        self.labels = np.concatenate([shard['labels'] for shard in self._shards] or [np.empty(0, np.int8)])
+        self.lang = np.concatenate([shard['lang'] for shard in self._shards] or [np.empty(0, np.uint8)])
+        self.groups = np.concatenate([shard['groups'] for shard in self._shards]) if self.meta['groups'] else None
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+        shard_index = int(np.searchsorted(self._starts, index, side='right')) - 1
+        shard = self._shards[shard_index]
+        row = index - self._starts[shard_index]
+        start, end = shard['offsets'][row], shard['offsets'][row + 1]
+        return {'input_ids': torch.from_numpy(shard['tokens'][start:end]), 'label': int(shard['labels'][row])}
+
+    def collate(self, batch: list[dict]) -> dict:
+        # Pads to the longest row of the batch, rounded up to PAD_TO_MULTIPLE_OF, the same shapes as encode()
+        longest = max(len(item['input_ids']) for item in batch)
+        width = -(-longest // PAD_TO_MULTIPLE_OF) * PAD_TO_MULTIPLE_OF
+        input_ids = torch.full((len(batch), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for i, item in enumerate(batch):
+            input_ids[i, : len(item['input_ids'])] = item['input_ids']
+            attention_mask[i, : len(item['input_ids'])] = 1
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'label': torch.tensor([item['label'] for item in batch], dtype=torch.long),
+        }
+
+    def __getstate__(self):
+        # Spawned DataLoader workers map the files again instead of receiving pickled copies of them
+        return {'directory': self.directory, 'meta': self.meta, 'pad_token_id': self.pad_token_id}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokenize the merged dataset into memory-mapped token shards')
+    parser.add_argument('--data', default='data/merged.csv')
+    parser.add_argument('--output', default='data/tokens')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=1000, help='Texts per tokenizer call')
+    parser.add_argument('--shard-rows', type=int, default=100_000)
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    meta = build_shards(args.data, Path(args.output), args.workers, args.batch_size, args.shard_rows, args.max_length)
+    elapsed = time.perf_counter() - start
+    print(
+        f'Tokenized {meta["rows"]} rows into {len(meta["shards"])} shards, {meta["tokens"]} tokens '
+        f'({meta["rows"] / elapsed:.0f} rows/s, {meta["tokens"] / elapsed:.0f} tokens/s)'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Trains TransformerClassifier on the token shards written by model.token_shards.
+
+Batches come from a length-bucketed sampler, so rows of similar length are padded together, and gradients can be
+accumulated over several batches per optimizer step. With torchrun the job runs as DistributedDataParallel on the
+gloo backend, on all cores of one machine or on several machines; every process trains on its own share of the
+batches with CPU count / processes threads.
+
+Checkpoints hold the model, optimizer, scheduler and the position in the epoch, and are written every
+--checkpoint-every optimizer steps and after every epoch. --resume continues from the latest one with the same
+batches the interrupted run would have seen. The best weights by validation loss are written as a plain state dict,
+which load_classifier and model.artifacts take as is.
+
+Throughput is reported in real (non-padding) tokens per second over all processes, next to the share of padding.
+
+Usage:
+    python -m model.train --data data/tokens
+    torchrun --nproc-per-node 4 -m model.train --data data/tokens --accumulate 2
+    torchrun --nnodes 2 --nproc-per-node 8 --rdzv-backend c10d --rdzv-endpoint host:29500 -m model.train ...
+"""
+
+import argparse
+import os
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Sampler
+
+from model.token_shards import TokenShardDataset
+from model.transformer import TransformerClassifier
+
+MODEL_DIR = Path(__file__).parent
+
+
+class LengthBucketSampler(Sampler[list[int]]):
+    """Batches of `indices` whose rows have similar lengths, in a different order every epoch.
+
+    The shuffled indices are cut into buckets of `bucket_batches` batches, every bucket is sorted by length and cut
+    into batches, and the batches are shuffled again, so batches are short or long at random while padding stays
+    low. With several processes each one takes every `world_size`-th batch; with `even` all processes get the same
+    number of batches, which DistributedDataParallel needs. The order depends only on `seed` and the epoch, which
+    lets a resumed run `skip` the batches it has already trained on.
+    """
+
+    def __init__(
+        self,
+        indices: np.ndarray,
+        lengths: np.ndarray,
+        batch_size: int,
+        bucket_batches: int = 50,
+        shuffle: bool = True,
+        seed: int = 0,
+        rank: int = 0,
+        world_size: int = 1,
+        even: bool = True,
+    ):
+        self.indices = np.asarray(indices)
+        self.lengths = np.asarray(lengths)[self.indices]
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_batches
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.even = even
+        self.epoch = 0
+        self.skip = 0
+
+    def set_epoch(self, epoch: int, skip: int = 0):
+        self.epoch = epoch
+        self.skip = skip
+
+    def batches(self) -> list[list[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.indices)) if self.shuffle else np.arange(len(self.indices))
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start : start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i : i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        batches = batches[self.rank :: self.world_size][: self._per_rank()]
+        return [self.indices[batch].tolist() for batch in batches[self.skip :]]
+
+    def _per_rank(self) -> int:
+        full, rest = divmod(len(self.indices), self.bucket_size)
+        total = full * (self.bucket_size // self.batch_size) + -(-rest // self.batch_size)
+        if self.even:
+            return total // self.world_size
+        return len(range(self.rank, total, self.world_size))
+
+    def __len__(self):
+        return self._per_rank() - self.skip
+
+    def __iter__(self):
+        yield from self.batches()
+
+
+def split_indices(dataset: TokenShardDataset, val_fraction: float, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    # Whole near-duplicate clusters go to one side when the shards have groups, rows otherwise
+    groups = dataset.groups if dataset.groups is not None else np.arange(len(dataset))
+    unique = np.unique(groups)
+    val_groups = np.random.default_rng(seed).permutation(unique)[: int(len(unique) * val_fraction)]
+    is_val = np.isin(groups, val_groups)
+    return np.flatnonzero(~is_val), np.flatnonzero(is_val)
+
+
+class Throughput:
+    """Real and padded tokens, rows and loss since the last report, summed over all processes on report."""
+
+    def __init__(self, distributed: bool):
+        self.distributed = distributed
+        self._reset()
+
+    def _reset(self):
+        self.counts = torch.zeros(4, dtype=torch.float64)  # tokens, padded tokens, rows, loss * rows
+        self.start = time.perf_counter()
+
+    def add(self, attention_mask: torch.Tensor, loss: float):
+        rows = len(attention_mask)
+        self.counts += torch.tensor([attention_mask.sum().item(), attention_mask.numel(), rows, loss * rows])
+
+    def report(self) -> dict:
+        counts = self.counts.clone()
+        if self.distributed:
+            dist.all_reduce(counts)
+        seconds = time.perf_counter() - self.start
+        tokens, padded, rows, loss = counts.tolist()
+        self._reset()
+        return {
+            'tokens_per_s': tokens / seconds,
+            'rows_per_s': rows / seconds,
+            'padding': 1 - tokens / padded if padded else 0.0,
+            'loss': loss / rows if rows else 0.0,
+        }
+
+
+def evaluate(model: nn.Module, loader: DataLoader, criterion: nn.Module, distributed: bool) -> tuple[float, float]:
+    model.eval()
+    totals = torch.zeros(3, dtype=torch.float64)  # loss * rows, correct, rows
+    with torch.no_grad():
+        for batch in loader:
+            outputs = model(batch['input_ids'], batch['attention_mask'])
+            loss = criterion(outputs, batch['label'])
+            rows = len(batch['label'])
+            correct = (outputs.argmax(dim=1) == batch['label']).sum().item()
+            totals += torch.tensor([loss.item() * rows, correct, rows])
+    if distributed:
+        dist.all_reduce(totals)
+    loss, correct, rows = totals.tolist()
+    return loss / max(rows, 1), correct / max(rows, 1)
+
+
+def save_checkpoint(path: Path, state: dict):
+    # Written under a temporary name first, an interrupted save keeps the previous checkpoint
+    tmp_path = path.with_name(path.name + '.tmp')
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the transformer classifier on token shards')
+    parser.add_argument('--data', default='data/tokens', help='Directory written by model.token_shards')
+    parser.add_argument('--output', default=str(MODEL_DIR / 'checkpoints'))
+    parser.add_argument('--init', help='State dict to start from instead of random weights')
+    parser.add_argument('--resume', action='store_true', help='Continue from the latest checkpoint in --output')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32, help='Rows per batch and process')
+    parser.add_argument('--accumulate', type=int, default=1, help='Batches per optimizer step')
+    parser.add_argument('--bucket-batches', type=int, default=50, help='Batches sorted by length together')
+    parser.add_argument('--lr', type=float, default=2e-5)
+    parser.add_argument('--val-fraction', type=float, default=0.2)
+    parser.add_argument('--checkpoint-every', type=int, default=500, help='Optimizer steps between checkpoints')
+    parser.add_argument('--log-every', type=int, default=50, help='Optimizer steps between throughput reports')
+    parser.add_argument('--loader-workers', type=int, default=0)
+    parser.add_argument('--threads', type=int, help='Torch threads per process, CPU count / local processes by default')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # torchrun sets these for every process it starts
+    world_size = int(os.getenv('WORLD_SIZE', 1))
+    rank = int(os.getenv('RANK', 0))
+    local_world_size = int(os.getenv('LOCAL_WORLD_SIZE', 1))
+    distributed = world_size > 1
+    if distributed:
+        dist.init_process_group('gloo')
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_world_size))
+    torch.manual_seed(args.seed)
+
+    def log(message: str):
+        if rank == 0:
+            print(message, flush=True)
+
+    dataset = TokenShardDataset(args.data)
+    train_indices, val_indices = split_indices(dataset, args.val_fraction, args.seed)
+    train_sampler = LengthBucketSampler(
+        train_indices, dataset.lengths, args.batch_size, args.bucket_batches, True, args.seed, rank, world_size
+    )
+    val_sampler = LengthBucketSampler(
+        val_indices, dataset.lengths, args.batch_size, args.bucket_batches, False, args.seed, rank, world_size, False
+    )
+    loader_options = {'collate_fn': dataset.collate, 'num_workers': args.loader_workers}
+    train_loader = DataLoader(dataset, batch_sampler=train_sampler, **loader_options)
+    val_loader = DataLoader(dataset, batch_sampler=val_sampler, **loader_options)
+
+    model = TransformerClassifier(vocab_size=dataset.meta['vocab_size'])
+    if args.init:
+        model.load_state_dict(torch.load(args.init, map_location='cpu'))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    latest_path = output / 'latest.pt'
+    state = {'epoch': 0, 'batch': 0, 'step': 0, 'best_val_loss': float('inf')}
+    if args.resume and latest_path.exists():
+        checkpoint = torch.load(latest_path, map_location='cpu', weights_only=False)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        state = checkpoint['state']
+        log(f'Resuming from epoch {state["epoch"] + 1}, batch {state["batch"]}, step {state["step"]}')
+
+    train_model = DistributedDataParallel(model) if distributed else model
+
+    def checkpoint(epoch: int, batch: int):
+        state.update(epoch=epoch, batch=batch)
+        if rank == 0:
+            save_checkpoint(
+                latest_path,
+                {
+                    'model': model.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(),
+                    'state': state,
+                    'args': vars(args),
+                },
+            )
+
+    log(
+        f'{len(train_indices)} training and {len(val_indices)} validation rows, {world_size} processes, '
+        f'{len(train_sampler)} batches of {args.batch_size} per process and epoch'
+    )
+    for epoch in range(state['epoch'], args.epochs):
+        train_sampler.set_epoch(epoch, skip=state['batch'] if epoch == state['epoch'] else 0)
+        batches = train_sampler.skip + len(train_sampler)
+        throughput = Throughput(distributed)
+        epoch_start = time.perf_counter()
+        train_model.train()
+
+        for batch_index, batch in enumerate(train_loader, start=train_sampler.skip):
+            step_end = (batch_index + 1) % args.accumulate == 0 or batch_index + 1 == batches
+            # Gradients are only averaged between processes on the last batch of a step
+            with train_model.no_sync() if distributed and not step_end else nullcontext():
+                outputs = train_model(batch['input_ids'], batch['attention_mask'])
+                loss = criterion(outputs, batch['label'])
+                (loss / args.accumulate).backward()
+            throughput.add(batch['attention_mask'], loss.item())
+            if not step_end:
+                continue
+
+            optimizer.step()
+            optimizer.zero_grad()
+            state['step'] += 1
+            if state['step'] % args.log_every == 0:
+                stats = throughput.report()
+                log(
+                    f'epoch {epoch + 1} batch {batch_index + 1}/{batches} step {state["step"]}: '
+                    f'loss {stats["loss"]:.4f}, {stats["tokens_per_s"]:.0f} tokens/s, '
+                    f'{stats["rows_per_s"]:.1f} rows/s, {stats["padding"]:.1%} padding'
+                )
+            if state['step'] % args.checkpoint_every == 0:
+                checkpoint(epoch, batch_index + 1)
+
+        val_loss, val_acc = evaluate(model, val_loader, criterion, distributed)
+        scheduler.step(val_loss)
+        log(
+            f'Epoch {epoch + 1}/{args.epochs}: val loss {val_loss:.4f}, val acc {val_acc:.4f}, '
+            f'{time.perf_counter() - epoch_start:.0f}s'
+        )
+        if val_loss < state['best_val_loss']:
+            state['best_val_loss'] = val_loss
+            if rank == 0:
+                save_checkpoint(output / 'best.pth', model.state_dict())
+                log(f'New best weights in {output / "best.pth"}')
+        checkpoint(epoch + 1, 0)
+
+    if distributed:
+        dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,75 @@
+import json
+import mmap
+import os
+import struct
+from functools import lru_cache
+from pathlib import Path
+
+import torch
 import torch.nn as nn
 from transformers import AutoTokenizer
 
-# Initialize tokenizer
-tokenizer = AutoTokenizer.from_pretrained('xlm-roberta-base')
+TOKENIZER_NAME = 'xlm-roberta-base'
+# Tokenizer and weights baked by `python -m model.artifacts`, loaded without any hub lookup when present
+ARTIFACTS_DIR = Path(os.getenv('MODEL_ARTIFACTS_DIR', Path(__file__).with_name('artifacts')))
 MAX_LENGTH = 512  # Maximum sequence length
+PAD_TO_MULTIPLE_OF = 32  # Bucket dynamic padding so batch shapes repeat
+WINDOW_STRIDE = 128  # Tokens shared by neighbouring windows when scoring long texts
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    # Loaded on first use rather than at import, so importing this module stays cheap
+    baked = ARTIFACTS_DIR / 'tokenizer'
+    if baked.exists():
+        return AutoTokenizer.from_pretrained(baked, local_files_only=True)
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+
+
+def default_weights_path() -> Path:
+    # The baked safetensors file is memory-mapped, the DVC-tracked state dict is the fallback
+    baked = ARTIFACTS_DIR / 'transformer.safetensors'
+    return baked if baked.exists() else Path(__file__).with_name('transformer.pth')
+
+
+def encode(texts, padding='longest', pad_to_multiple_of=PAD_TO_MULTIPLE_OF, max_length=MAX_LENGTH):
+    # 'longest' pads only up to the longest text in the batch, 'max_length' keeps the old fixed 512 shape
+    return get_tokenizer()(
+        texts,
+        add_special_tokens=True,
+        max_length=max_length,
+        padding=padding,
+        pad_to_multiple_of=pad_to_multiple_of if padding == 'longest' else None,
+        truncation=True,
+        return_tensors='pt',
+    )
+
+
+def encode_windows(text: str, stride=WINDOW_STRIDE, max_length=MAX_LENGTH):
+    # Splits a long text into overlapping MAX_LENGTH windows, one row per window, with character offsets per token
+    return get_tokenizer()(
+        text,
+        add_special_tokens=True,
+        max_length=max_length,
+        padding='longest',
+        pad_to_multiple_of=PAD_TO_MULTIPLE_OF,
+        truncation=True,
+        stride=stride,
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
+        return_special_tokens_mask=True,
+        return_tensors='pt',
+    )
 
 
 class TransformerClassifier(nn.Module):
-    def __init__(self, vocab_size, d_model=256, nhead=8, num_layers=6, dim_feedforward=1024, dropout=0.1):
+    def __init__(
+        self, vocab_size, d_model=256, nhead=8, num_layers=6, dim_feedforward=1024, dropout=0.1, pooling='padded'
+    ):
         super().__init__()
+        if pooling not in ('padded', 'mean'):
+            raise ValueError(f'Unknown pooling: {pooling}')
+        self.pooling = pooling
         self.embedding = nn.Embedding(vocab_size, d_model)
         self.pos_encoder = nn.Dropout(dropout)
 
@@ -35,9 +96,96 @@ class TransformerClassifier(nn.Module):
         # Transformer encoder
         x = self.transformer_encoder(x, src_key_padding_mask=padding_mask)
 
-        # Global average pooling
-        x = x.mean(dim=1)
+        # Global average pooling over real tokens only, so the result does not depend on how much padding was added
+        mask = attention_mask.unsqueeze(-1).to(x.dtype)
+        x = (x * mask).sum(dim=1)
+        if self.pooling == 'mean':
+            x = x / mask.sum(dim=1).clamp(min=1)
+        else:
+            # Released weights were scored on inputs padded to MAX_LENGTH, where the encoder zero-fills padded
+            # positions, so the old mean equals the sum over real tokens divided by MAX_LENGTH
+            x = x / MAX_LENGTH
 
         # Classification head
         x = self.classifier(x)
         return x
+
+
+SAFETENSORS_DTYPES = {'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16, 'I64': torch.int64}
+
+
+def load_safetensors(path) -> dict[str, torch.Tensor]:
+    """Maps a safetensors file into memory and returns tensors backed by the mapping, without copying.
+
+    The mapping is private copy-on-write: pages are read from the page cache on first access and shared with every
+    other process mapping the same file, as long as nobody writes to the weights.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (header_size,) = struct.unpack('<Q', buffer[:8])
+    header = json.loads(buffer[8 : 8 + header_size])
+    header.pop('__metadata__', None)
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        start, end = info['data_offsets']
+        count = (end - start) // dtype.itemsize
+        if count:
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=8 + header_size + start)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[name] = tensor.reshape(info['shape'])
+    return tensors
+
+
+class OnnxClassifier:
+    # Runs an ONNX export of TransformerClassifier with onnxruntime, called like the torch module
+
+    def __init__(self, path, threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(f'{path} is an ONNX artifact, which needs onnxruntime: pip install onnxruntime') from e
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, input_ids, attention_mask):
+        (logits,) = self.session.run(
+            ['logits'], {'input_ids': input_ids.cpu().numpy(), 'attention_mask': attention_mask.cpu().numpy()}
+        )
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def load_classifier(path, device='cpu'):
+    """Loads the classifier for inference from any of the supported artifacts.
+
+    `.pth` is the fp32 state dict, `.safetensors` the same weights baked by `model.artifacts` and memory-mapped,
+    `.pt` a TorchScript module written by `model.export` (possibly int8 quantized) and `.onnx` an ONNX graph run
+    with onnxruntime on CPU.
+    """
+    path = Path(path)
+    if path.suffix in ('.pth', '.safetensors'):
+        if path.suffix == '.pth':
+            state_dict = torch.load(path, map_location=device)
+        else:
+            state_dict = load_safetensors(path)
+        # Parameters are created on the meta device and then replaced by the loaded tensors, so the weights are
+        # neither initialized randomly nor copied
+        with torch.device('meta'):
+            model = TransformerClassifier(vocab_size=state_dict['embedding.weight'].shape[0])
+        model.load_state_dict(state_dict, assign=True)
+        model = model.to(device)
+    elif path.suffix == '.pt':
+        model = torch.jit.load(str(path), map_location=device)
+    elif path.suffix == '.onnx':
+        model = OnnxClassifier(path)
+    else:
+        raise ValueError(f'Unsupported classifier artifact: {path}')
+    model.eval()
+    return model
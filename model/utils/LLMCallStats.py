@@ -0,0 +1,65 @@
+import time
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from model.metrics import LLM_RETRIES, LLM_STAGE_SECONDS, LLM_TOKENS
+
+
+class LLMCallStats(AsyncCallbackHandler):
+    """Collects what happens inside one chain call: request attempts, time spent waiting for the LLM and tokens.
+
+    Pass a fresh instance per call in `config={'callbacks': [stats]}`.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.errors = 0
+        self.llm_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._started = {}
+
+    @property
+    def retries(self) -> int:
+        return max(self.attempts - 1, 0)
+
+    def _start(self, run_id):
+        self.attempts += 1
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.llm_seconds += time.perf_counter() - started
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+        usage = (response.llm_output or {}).get('token_usage')
+        if usage:
+            self.prompt_tokens += usage.get('prompt_tokens') or 0
+            self.completion_tokens += usage.get('completion_tokens') or 0
+            return
+        # Newer langchain-openai versions report usage on the message instead
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                self.prompt_tokens += usage.get('input_tokens', 0)
+                self.completion_tokens += usage.get('output_tokens', 0)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+        self.errors += 1
+
+    def record(self, evaluator: str, seconds: float):
+        # The part of the chain call not spent waiting for the LLM is prompt formatting and output parsing
+        LLM_STAGE_SECONDS.labels(evaluator=evaluator, stage='request').observe(self.llm_seconds)
+        LLM_STAGE_SECONDS.labels(evaluator=evaluator, stage='parse').observe(max(seconds - self.llm_seconds, 0))
+        LLM_TOKENS.labels(evaluator=evaluator, kind='prompt').inc(self.prompt_tokens)
+        LLM_TOKENS.labels(evaluator=evaluator, kind='completion').inc(self.completion_tokens)
+        LLM_RETRIES.labels(evaluator=evaluator).inc(self.retries)
@@ -17,4 +17,6 @@ class OpenRouter(ChatOpenAI):
 
     def __init__(self, openai_api_key: str | None = None, **kwargs):
         openai_api_key = openai_api_key or os.getenv('OPENROUTER_API_KEY')
-        super().__init__(base_url='https://openrouter.ai/api/v1', openai_api_key=openai_api_key, **kwargs)
+        # OPENROUTER_BASE_URL points the client elsewhere, e.g. at the local stub used by model.benchmark
+        base_url = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+        super().__init__(base_url=base_url, openai_api_key=openai_api_key, **kwargs)
@@ -1,54 +1,73 @@
-from pathlib import Path
+import threading
+from functools import lru_cache
+from typing import Optional
 
 import torch
 from captum.attr import LayerGradCam
 
-from model.transformer import MAX_LENGTH, TransformerClassifier, tokenizer
+from model.transformer import TransformerClassifier, default_weights_path, encode, get_tokenizer, load_classifier
 
 
-def analyze_text_with_gradcam(text: str) -> list[dict[str, float]]:
-    # Load model and weights
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = TransformerClassifier(
-        vocab_size=tokenizer.vocab_size, d_model=256, nhead=8, num_layers=6, dim_feedforward=1024, dropout=0.1
-    )
-    path = Path(__file__).resolve().parent.parent.parent / 'model' / 'transformer.pth'
-    model.load_state_dict(torch.load(path, map_location=device))
-    model.to(device)
-    model.eval()
-
-    # Tokenize input text
-    encoding = tokenizer(text, max_length=MAX_LENGTH, padding='max_length', truncation=True, return_tensors='pt')
-    input_ids = encoding['input_ids'].to(device)
-    attention_mask = encoding['attention_mask'].to(device)
-
-    # Initialize Grad-CAM
-    grad_cam = LayerGradCam(model, model.transformer_encoder)
-
-    # Get Grad-CAM attributions for AI-written class (0)
-    attributions = grad_cam.attribute(
-        input_ids,
-        target=0,  # Target class (AI-written = 0, Human-written = 1)
-        additional_forward_args=(attention_mask,),
-    )
-
-    # Process tokens and their scores
-    tokens = tokenizer.convert_ids_to_tokens(input_ids[0])
-    # Detach the tensor before converting to numpy
-    token_scores = attributions[0].detach().cpu().numpy()[0]
-
-    # Create result list with token-level scores
-    results = []
-    for token, score in zip(tokens, token_scores):
-        if token not in ['[PAD]', '[CLS]', '[SEP]']:
-            # Normalize score to probability range [0, 1]
-            normalized_score = float((score - token_scores.min()) / (token_scores.max() - token_scores.min()))
-            results.append(
-                {
-                    'token': token,
-                    'ai_prob': normalized_score,  # Higher score means more likely to be AI-written
-                    'is_special_token': token.startswith('[') and token.endswith(']'),
-                }
+class TokenAttributor:
+    """Grad-CAM token attributions computed on an already loaded classifier.
+
+    Several texts are attributed in one forward/backward pass. `lock` should be shared with every other user of
+    the same model, since Grad-CAM temporarily hooks into the encoder.
+    """
+
+    def __init__(self, model: TransformerClassifier, device='cpu', lock: Optional[threading.Lock] = None):
+        self.model = model
+        self.device = device
+        self.lock = lock or threading.Lock()
+        self.grad_cam = LayerGradCam(model, model.transformer_encoder)
+
+    def attribute(self, texts: list[str]) -> list[list[dict[str, float]]]:
+        # Tokenize input texts
+        encoding = encode(texts)
+        input_ids = encoding['input_ids'].to(self.device)
+        attention_mask = encoding['attention_mask'].to(self.device)
+
+        # Get Grad-CAM attributions for AI-written class (0)
+        with self.lock:
+            attributions = self.grad_cam.attribute(
+                input_ids,
+                target=0,  # Target class (AI-written = 0, Human-written = 1)
+                additional_forward_args=(attention_mask,),
             )
+        # Detach the tensor before converting to numpy
+        attributions = attributions.detach().cpu().numpy()
+
+        results = []
+        for ids, mask, scores in zip(input_ids, attention_mask, attributions):
+            tokens = get_tokenizer().convert_ids_to_tokens(ids[mask.bool()])
+            results.append(self._token_scores(tokens, scores[0]))
+        return results
 
-    return results
+    def _token_scores(self, tokens: list[str], token_scores) -> list[dict[str, float]]:
+        score_range = token_scores.max() - token_scores.min()
+
+        # Create result list with token-level scores
+        results = []
+        for token, score in zip(tokens, token_scores):
+            if token not in ['[PAD]', '[CLS]', '[SEP]']:
+                # Normalize score to probability range [0, 1]
+                normalized_score = float((score - token_scores.min()) / score_range) if score_range else 0.0
+                results.append(
+                    {
+                        'token': token,
+                        'ai_prob': normalized_score,  # Higher score means more likely to be AI-written
+                        'is_special_token': token.startswith('[') and token.endswith(']'),
+                    }
+                )
+        return results
+
+
+@lru_cache(maxsize=1)
+def _default_attributor() -> TokenAttributor:
+    # Load model and weights once per process
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return TokenAttributor(load_classifier(default_weights_path(), device), device)
+
+
+def analyze_text_with_gradcam(text: str) -> list[dict[str, float]]:
+    return _default_attributor().attribute([text])[0]
@@ -0,0 +1,177 @@
+"""A minimal in-memory Airtable Web API for tests, served over HTTP so pyairtable talks to it unchanged.
+
+Covers what AirtableClient uses: creating one record or a batch of up to 10, upserts on `performUpsert` fields, and
+listing records with `filterByFormula` (the `{field}='value'` and AND(...) formulas of pyairtable.formulas.match),
+`sort`, `fields[]` and `maxRecords`, by GET or by POST to listRecords. Point a client at it with
+AIRTABLE_ENDPOINT_URL=fake.url.
+"""
+
+import itertools
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+MAX_RECORDS_PER_REQUEST = 10
+
+_CONDITION = re.compile(r"\{((?:[^}\\]|\\.)*)\}=('(?:[^'\\]|\\.)*'|[^,)]+)")
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def parse_formula(formula: str) -> Dict[str, str]:
+    # {field}='value' or AND({a}='x',{b}=1) into {field: value}, values compared as strings
+    conditions = {}
+    for field, value in _CONDITION.findall(formula):
+        conditions[_unescape(field)] = _unescape(value[1:-1]) if value.startswith("'") else value
+    return conditions
+
+
+class FakeAirtable:
+    def __init__(self):
+        self.tables: Dict[str, List[Dict]] = {}
+        self.requests: List[tuple[str, str]] = []
+        # Number of upcoming writes to store and then answer 500, as if the response was lost on the way back
+        self.fail_after_write = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self) -> 'FakeAirtable':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def rows(self, table: str) -> List[Dict]:
+        return [record['fields'] for record in self.tables.get(table, [])]
+
+    def _new_record(self, table: str, fields: Dict) -> Dict:
+        record = {'id': f'rec{next(self._ids):014d}', 'createdTime': '2024-01-01T00:00:00.000Z', 'fields': fields}
+        self.tables.setdefault(table, []).append(record)
+        return record
+
+    def _list(self, table: str, options: Dict) -> Dict:
+        records = self.tables.get(table, [])
+        conditions = parse_formula(options.get('filterByFormula') or '')
+        records = [r for r in records if all(str(r['fields'].get(k)) == v for k, v in conditions.items())]
+        for sort in reversed(options.get('sort') or []):
+            records = sorted(
+                records, key=lambda r: str(r['fields'].get(sort['field'], '')), reverse=sort.get('direction') == 'desc'
+            )
+        if options.get('maxRecords'):
+            records = records[: int(options['maxRecords'])]
+        if options.get('fields'):
+            records = [
+                {**r, 'fields': {k: v for k, v in r['fields'].items() if k in options['fields']}} for r in records
+            ]
+        return {'records': records}
+
+    def _write(self, method: str, table: str, body: Dict) -> tuple[int, Dict]:
+        if 'records' not in body:
+            return 200, self._new_record(table, body['fields'])
+        if len(body['records']) > MAX_RECORDS_PER_REQUEST:
+            return 422, {'error': {'type': 'INVALID_RECORDS', 'message': 'Too many records'}}
+        if method == 'POST':
+            return 200, {'records': [self._new_record(table, record['fields']) for record in body['records']]}
+
+        key_fields = body.get('performUpsert', {}).get('fieldsToMergeOn', [])
+        result = {'records': [], 'createdRecords': [], 'updatedRecords': []}
+        for record in body['records']:
+            existing = next(
+                (
+                    r
+                    for r in self.tables.get(table, [])
+                    if all(r['fields'].get(k) == record['fields'].get(k) for k in key_fields)
+                ),
+                None,
+            )
+            if existing is None:
+                existing = self._new_record(table, record['fields'])
+                result['createdRecords'].append(existing['id'])
+            else:
+                existing['fields'].update(record['fields'])
+                result['updatedRecords'].append(existing['id'])
+            result['records'].append(existing)
+        return 200, result
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, payload: Dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _table(self, path: str) -> tuple[str, Optional[str]]:
+                # /v0/{base}/{table}[/listRecords]
+                parts = [unquote(part) for part in path.strip('/').split('/')]
+                return parts[2], parts[3] if len(parts) > 3 else None
+
+            def _body(self) -> Dict:
+                return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                table, _ = self._table(url.path)
+                query = parse_qs(url.query)
+                sort = []
+                for i in itertools.count():
+                    if f'sort[{i}][field]' not in query:
+                        break
+                    sort.append(
+                        {'field': query[f'sort[{i}][field]'][0], 'direction': query[f'sort[{i}][direction]'][0]}
+                    )
+                options = {
+                    'filterByFormula': query.get('filterByFormula', [''])[0],
+                    'maxRecords': query.get('maxRecords', [None])[0],
+                    'fields': query.get('fields[]'),
+                    'sort': sort,
+                }
+                with fake._lock:
+                    fake.requests.append(('GET', table))
+                    self._reply(200, fake._list(table, options))
+
+            def do_POST(self):
+                table, action = self._table(urlparse(self.path).path)
+                body = self._body()
+                with fake._lock:
+                    fake.requests.append(('POST', table))
+                    if action == 'listRecords':
+                        self._reply(200, fake._list(table, body))
+                        return
+                    self._write_reply('POST', table, body)
+
+            def do_PATCH(self):
+                table, _ = self._table(urlparse(self.path).path)
+                body = self._body()
+                with fake._lock:
+                    fake.requests.append(('PATCH', table))
+                    self._write_reply('PATCH', table, body)
+
+            def _write_reply(self, method: str, table: str, body: Dict):
+                status, payload = fake._write(method, table, body)
+                if status == 200 and fake.fail_after_write:
+                    fake.fail_after_write -= 1
+                    status, payload = 500, {'error': {'type': 'SERVER_ERROR', 'message': 'Response lost'}}
+                self._reply(status, payload)
+
+        return Handler
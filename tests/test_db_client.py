@@ -0,0 +1,80 @@
+import pytest
+from fake_airtable import FakeAirtable
+
+from app.backend import db_client
+from app.backend.db_client import AirtableClient
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeAirtable().start()
+    monkeypatch.setenv('AIRTABLE_TOKEN', 'test-token')
+    monkeypatch.setenv('AIRTABLE_ENDPOINT_URL', fake.url)
+    yield fake
+    fake.stop()
+
+
+def record(record_id: str, text: str = 'text') -> dict:
+    return {
+        'record_id': record_id,
+        'text': text,
+        'tokens': [{'token': 'te', 'ai_prob': 0.25, 'is_special_token': False}],
+        'explanation': 'explanation',
+        'score': 0.75,
+        'examples': 'examples',
+    }
+
+
+def test_users_are_found_by_tg_id(fake):
+    user_id = AirtableClient().create_user('42', 'login', None)['fields']['user_id']
+
+    # A new client has nothing cached and has to run the filtered query
+    assert AirtableClient().get_user_id_by_tg_id(42) == user_id
+    assert AirtableClient().get_user_id_by_tg_id('43') is None
+
+
+def test_records_round_trip_through_batches_of_ten(fake):
+    client = AirtableClient()
+    client.create_records([record(f'r{i:02d}', f'text {i}') for i in range(25)])
+
+    assert len(fake.rows('Records')) == 25
+    assert fake.requests.count(('PATCH', 'Records')) == 3
+    assert AirtableClient().get_record_by_id('r07') == record('r07', 'text 7')
+    assert AirtableClient().get_record_by_id('missing') is None
+    assert AirtableClient().get_last_record()['record_id'] == 'r24'
+
+
+def test_retried_writes_are_not_duplicated(fake):
+    client = AirtableClient()
+    fake.fail_after_write = 1
+    with pytest.raises(Exception):
+        client.create_records([record('r1'), record('r2')])
+    # The first attempt reached the server, a retry of the same records must not add them again
+    client.create_records([record('r1'), record('r2')])
+    client.link_users_to_records([('u1', 'r1')])
+    client.link_users_to_records([('u1', 'r1')])
+
+    assert sorted(row['record_id'] for row in fake.rows('Records')) == ['r1', 'r2']
+    assert fake.rows('Links') == [{'user_id': 'u1', 'record_id': 'r1'}]
+
+
+def test_last_record_of_user(fake):
+    client = AirtableClient()
+    user_id = client.create_user('7', None, None)['fields']['user_id']
+    client.create_records([record('r1'), record('r2'), record('r3')])
+    client.link_users_to_records([(user_id, 'r1'), (user_id, 'r3')])
+    client.link_user_to_record(user_id, 'r2')
+
+    assert AirtableClient().get_last_record_by_tg_id('7')['record_id'] == 'r3'
+    assert AirtableClient().get_last_record_by_tg_id('8') is None
+
+
+def test_record_cache_is_bounded_by_memory(fake, monkeypatch):
+    monkeypatch.setattr(db_client, 'RECORD_CACHE_BYTES', 200_000)
+    client = AirtableClient()
+    client.create_records([record(f'r{i:02d}', 'x' * 10_000) for i in range(50)])
+
+    assert 0 < len(client._records) < 50
+    assert client._records.bytes <= 200_000
+    # Evicted records are fetched from the server again
+    assert client.get_record_by_id('r00')['text'] == 'x' * 10_000